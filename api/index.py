@@ -1,153 +1,458 @@
 import os
 import json
-from typing import List
-from openai.types.chat.chat_completion_message_param import ChatCompletionMessageParam
-from pydantic import BaseModel
-from dotenv import load_dotenv
-from fastapi import FastAPI, Query
-from fastapi.responses import StreamingResponse
-from openai import OpenAI
+import time
+import asyncio
+import threading
+from typing import TYPE_CHECKING, List, Literal, Optional
+from contextlib import asynccontextmanager
+from pydantic import BaseModel, PrivateAttr, model_validator
+from fastapi import FastAPI, Header, HTTPException, Query
+from fastapi import Request as HTTPRequest
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from .utils.prompt import ClientMessage, convert_to_openai_messages
-from .utils.tools import get_current_weather
+from .utils.budget import fit_messages, load_tokenizer
+from .utils.session import create_session_store, session_key
+from .utils.fake_openai import OPENAI_FAKE, OPENAI_RECORD, FakeAsyncOpenAI, RecordingAsyncOpenAI
+from .utils.response_cache import RESPONSE_CACHE, ResponseCache, response_key
+from .utils.tools import tools, weather_cache
+from .utils.executor import execute_tool_calls, parse_arguments, tool_flights
+from .utils.http import UPSTREAM_WARMUP_CONNECTIONS, close_http_client, create_upstream_client, http_pool_stats, pool_stats, warm_up
+from .utils.coalesce import coalesce_text
+from .utils.compression import compress_stream, negotiate_encoding
+from .utils.metrics import metrics, observe_stream, requests_total, tokens_total, upstream_first_chunk_seconds
+from .utils.tracing import exporter, record_span, span, start_span, trace_stream
+from .utils.profiling import new_profile, profile_stream, should_profile
+from .utils.admission import AdmissionController, Rejected, client_id, hold, retry_after_header
+from .utils.disconnect import cancel_on_disconnect
+from .utils.quota import QuotaExceeded, Reservation, TokenQuota, estimate_tokens
+from .utils.data_stream import text_frame, tool_call_frame, tool_result_frame, finish_step_frame
 
+if TYPE_CHECKING:
+    from openai.types.chat.chat_completion_message_param import ChatCompletionMessageParam
 
-load_dotenv(".env.local")
 
-app = FastAPI()
+# Vercel injects the project's environment variables itself; the file is
+# only for local development.
+if not os.environ.get("VERCEL") and os.path.exists(".env.local"):
+    from dotenv import load_dotenv
+    load_dotenv(".env.local")
 
-client = OpenAI(
-    api_key=os.environ.get("OPENAI_API_KEY"),
-)
+# The OpenAI SDK is the bulk of a cold start. It is imported on the first
+# request; a long-running server instead warms it up, and opens its first
+# upstream connections, in the background as soon as it starts. Off on
+# Vercel, where that would put the import back into the cold start.
+STARTUP_PREWARM = os.environ.get(
+    "STARTUP_PREWARM", "0" if os.environ.get("VERCEL") else "1") == "1"
+
+
+async def prewarm():
+    await load_tokenizer()
+    await asyncio.to_thread(get_client)
+
+    if upstream_http is not None and UPSTREAM_WARMUP_CONNECTIONS > 0:
+        await warm_up(upstream_http, os.environ.get(
+            "OPENAI_BASE_URL") or "https://api.openai.com/v1")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    task = asyncio.create_task(prewarm()) if STARTUP_PREWARM else None
+    yield
+    if task is not None:
+        task.cancel()
+    await exporter.flush()
+    await close_http_client()
+    if upstream_http is not None:
+        await upstream_http.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
+
+client = None
+upstream_http = None
+# The prewarm thread and the first request may both get here first.
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global client, upstream_http
+
+    if client is not None:
+        return client
+
+    with _client_lock:
+        if client is not None:
+            return client
+
+        if OPENAI_FAKE:
+            client = FakeAsyncOpenAI(OPENAI_FAKE)
+        else:
+            from openai import AsyncOpenAI
+
+            upstream_http = create_upstream_client()
+            upstream = AsyncOpenAI(
+                api_key=os.environ.get("OPENAI_API_KEY"),
+                http_client=upstream_http,
+            )
+
+            client = RecordingAsyncOpenAI(upstream, OPENAI_RECORD) if OPENAI_RECORD else upstream
+
+    return client
 
 
 class Request(BaseModel):
-    messages: List[ClientMessage]
+    id: Optional[str] = None
+    messages: List[ClientMessage] = []
+    # With a session store, a client may send only its new message (or
+    # nothing, to continue after a tool step) instead of the full history.
+    message: Optional[ClientMessage] = None
+
+    # FastAPI validates the body before the handler starts its trace, so
+    # the timing is kept here and recorded as a span afterwards.
+    _validation_started: int = PrivateAttr(0)
+    _validation_seconds: float = PrivateAttr(0.0)
+
+    @model_validator(mode="after")
+    def check_messages(self):
+        if not self.messages and self.message is None and not (self.id and sessions is not None):
+            raise ValueError("messages or message is required")
+        return self
 
+    @model_validator(mode="wrap")
+    @classmethod
+    def time_validation(cls, data, handler):
+        started_at = time.time_ns()
+        started = time.perf_counter()
+        request = handler(data)
+        request._validation_started = started_at
+        request._validation_seconds = time.perf_counter() - started
+        return request
 
-available_tools = {
-    "get_current_weather": get_current_weather,
-}
 
-def do_stream(messages: List[ChatCompletionMessageParam]):
-    stream = client.chat.completions.create(
+available_tools = tools
+
+sessions = create_session_store()
+
+response_cache = ResponseCache() if RESPONSE_CACHE else None
+
+admission = AdmissionController()
+
+quota = TokenQuota()
+
+metrics.collect("weather_cache", weather_cache.stats, weather_cache.counter_stats)
+metrics.collect("tool_single_flight", lambda: {"shared": tool_flights.shared}, ("shared",))
+metrics.collect("admission", admission.stats, admission.counter_stats)
+metrics.collect("token_quota", quota.stats, quota.counter_stats)
+metrics.collect("tool_http_pool", http_pool_stats)
+metrics.collect("upstream_http_pool", lambda: pool_stats(upstream_http))
+if response_cache is not None:
+    metrics.collect("response_cache", response_cache.stats, response_cache.counter_stats)
+
+async def do_stream(messages: List["ChatCompletionMessageParam"]):
+    stream = await get_client().chat.completions.create(
         messages=messages,
         model="gpt-4o",
         stream=True,
-        tools=[{
-            "type": "function",
-            "function": {
-                "name": "get_current_weather",
-                "description": "Get the current weather at a location",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "latitude": {
-                            "type": "number",
-                            "description": "The latitude of the location",
-                        },
-                        "longitude": {
-                            "type": "number",
-                            "description": "The longitude of the location",
-                        },
-                    },
-                    "required": ["latitude", "longitude"],
-                },
-            },
-        }]
+        tools=available_tools.schemas,
     )
 
     return stream
 
-def stream_text(messages: List[ChatCompletionMessageParam], protocol: str = 'data'):
-    draft_tool_calls = []
-    draft_tool_calls_index = -1
+async def create_stream(
+    messages: List["ChatCompletionMessageParam"],
+    use_tools: bool = True,
+    reservation: Optional[Reservation] = None,
+):
+    if response_cache is not None:
+        key = response_key(
+            "gpt-4o", messages, available_tools.schemas_json if use_tools else "")
+        recording = await response_cache.get(key, messages)
+        if recording is not None:
+            # A replay costs no tokens, whatever its usage chunk says.
+            if reservation is not None:
+                reservation.settle(0)
+            return response_cache.replay(recording), True
 
-    stream = client.chat.completions.create(
+    stream = await get_client().chat.completions.create(
         messages=messages,
         model="gpt-4o",
         stream=True,
-        tools=[{
-            "type": "function",
-            "function": {
-                "name": "get_current_weather",
-                "description": "Get the current weather at a location",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "latitude": {
-                            "type": "number",
-                            "description": "The latitude of the location",
-                        },
-                        "longitude": {
-                            "type": "number",
-                            "description": "The longitude of the location",
-                        },
-                    },
-                    "required": ["latitude", "longitude"],
-                },
-            },
-        }]
+        stream_options={"include_usage": True},
+        **({"tools": available_tools.schemas} if use_tools else {}),
     )
 
-    for chunk in stream:
-        for choice in chunk.choices:
-            if choice.finish_reason == "stop":
-                continue
-
-            elif choice.finish_reason == "tool_calls":
-                for tool_call in draft_tool_calls:
-                    yield '9:{{"toolCallId":"{id}","toolName":"{name}","args":{args}}}\n'.format(
-                        id=tool_call["id"],
-                        name=tool_call["name"],
-                        args=tool_call["arguments"])
-
-                for tool_call in draft_tool_calls:
-                    tool_result = available_tools[tool_call["name"]](
-                        **json.loads(tool_call["arguments"]))
-
-                    yield 'a:{{"toolCallId":"{id}","toolName":"{name}","args":{args},"result":{result}}}\n'.format(
-                        id=tool_call["id"],
-                        name=tool_call["name"],
-                        args=tool_call["arguments"],
-                        result=json.dumps(tool_result))
-
-            elif choice.delta.tool_calls:
-                for tool_call in choice.delta.tool_calls:
-                    id = tool_call.id
-                    name = tool_call.function.name
-                    arguments = tool_call.function.arguments
-
-                    if (id is not None):
-                        draft_tool_calls_index += 1
-                        draft_tool_calls.append(
-                            {"id": id, "name": name, "arguments": ""})
-
-                    else:
-                        draft_tool_calls[draft_tool_calls_index]["arguments"] += arguments
+    if response_cache is not None:
+        return response_cache.record(key, messages, stream), False
 
-            else:
-                yield '0:{text}\n'.format(text=json.dumps(choice.delta.content))
-
-        if chunk.choices == []:
-            usage = chunk.usage
-            prompt_tokens = usage.prompt_tokens
-            completion_tokens = usage.completion_tokens
-
-            yield 'e:{{"finishReason":"{reason}","usage":{{"promptTokens":{prompt},"completionTokens":{completion}}},"isContinued":false}}\n'.format(
-                reason="tool-calls" if len(
-                    draft_tool_calls) > 0 else "stop",
-                prompt=prompt_tokens,
-                completion=completion_tokens
-            )
+    return stream, False
+
+
+async def close_stream(stream):
+    close = getattr(stream, "aclose", None) or getattr(stream, "close", None)
+    if close is not None:
+        await close()
+
+
+async def stream_events(
+    messages: List["ChatCompletionMessageParam"],
+    use_tools: bool = True,
+    transcript: Optional[List[dict]] = None,
+    reservation: Optional[Reservation] = None,
+):
+    """
+    Yield text deltas as `str` and every other data stream frame as
+    encoded `bytes`. If `transcript` is given, the messages produced by
+    this step are appended to it in OpenAI format. If `reservation` is
+    given, it is settled to the usage the model reports.
+    """
+    draft_tool_calls = []
+    draft_tool_calls_index = -1
+    text = []
+
+    with span("openai.chat.completions", model="gpt-4o", messages=len(messages)) as upstream:
+        started = time.perf_counter()
+        stream, replayed = await create_stream(messages, use_tools, reservation)
+        upstream.set_attribute("cached", replayed)
+        first_chunk = True
+
+        try:
+            async for chunk in stream:
+                if first_chunk:
+                    upstream_first_chunk_seconds.observe(time.perf_counter() - started)
+                    first_chunk = False
+
+                for choice in chunk.choices:
+                    if choice.finish_reason == "stop":
+                        continue
 
+                    elif choice.finish_reason == "tool_calls":
+                        for tool_call in draft_tool_calls:
+                            yield tool_call_frame(
+                                tool_call["id"], tool_call["name"], parse_arguments(tool_call))
 
+                        tool_messages = []
+
+                        async for tool_call, tool_result in execute_tool_calls(
+                                draft_tool_calls, available_tools):
+                            tool_result = available_tools.project(
+                                tool_call["name"], tool_result)
+                            yield tool_result_frame(
+                                tool_call["id"], tool_call["name"], tool_call["args"], tool_result)
+
+                            if transcript is not None:
+                                tool_messages.append({
+                                    "role": "tool",
+                                    "tool_call_id": tool_call["id"],
+                                    "content": json.dumps(available_tools.model_view(
+                                        tool_call["name"], tool_result)),
+                                })
+
+                        if transcript is not None:
+                            transcript.append({
+                                "role": "assistant",
+                                "content": [{"type": "text", "text": "".join(text)}],
+                                "tool_calls": [{
+                                    "id": tool_call["id"],
+                                    "type": "function",
+                                    "function": {
+                                        "name": tool_call["name"],
+                                        "arguments": tool_call["arguments"],
+                                    },
+                                } for tool_call in draft_tool_calls],
+                            })
+                            transcript.extend(tool_messages)
+
+                    elif choice.delta.tool_calls:
+                        for tool_call in choice.delta.tool_calls:
+                            id = tool_call.id
+                            name = tool_call.function.name
+                            arguments = tool_call.function.arguments
+
+                            if (id is not None):
+                                draft_tool_calls_index += 1
+                                draft_tool_calls.append(
+                                    {"id": id, "name": name, "arguments": ""})
+
+                            else:
+                                draft_tool_calls[draft_tool_calls_index]["arguments"] += arguments
+
+                    elif choice.delta.content:
+                        if transcript is not None:
+                            text.append(choice.delta.content)
+                        yield choice.delta.content
+
+                if chunk.choices == [] and chunk.usage is not None:
+                    usage = chunk.usage
+                    if not replayed:
+                        tokens_total.inc(usage.prompt_tokens, "prompt")
+                        tokens_total.inc(usage.completion_tokens, "completion")
+                    upstream.set_attribute("prompt_tokens", usage.prompt_tokens)
+                    upstream.set_attribute("completion_tokens", usage.completion_tokens)
+                    if reservation is not None:
+                        reservation.settle(usage.prompt_tokens + usage.completion_tokens)
+
+                    yield finish_step_frame(
+                        "tool-calls" if len(draft_tool_calls) > 0 else "stop",
+                        usage.prompt_tokens,
+                        usage.completion_tokens,
+                    )
+        finally:
+            # Drop the upstream response now instead of whenever it's garbage
+            # collected. After a disconnect this stops the generation we'd
+            # still be paying for, and it frees the pooled connection.
+            await asyncio.shield(close_stream(stream))
+
+    if transcript is not None and not draft_tool_calls:
+        transcript.append({
+            "role": "assistant",
+            "content": [{"type": "text", "text": "".join(text)}],
+            "tool_calls": None,
+        })
+
+
+async def stream_text(
+    messages: List["ChatCompletionMessageParam"],
+    protocol: str = 'data',
+    transcript: Optional[List[dict]] = None,
+    reservation: Optional[Reservation] = None,
+):
+    if protocol == 'text':
+        # Plain text: the raw content bytes with no framing. Tool calls can't
+        # be represented, so the model isn't offered any.
+        async for event in coalesce_text(stream_events(messages, False, transcript, reservation)):
+            if isinstance(event, str):
+                yield event.encode()
+        return
+
+    async for event in coalesce_text(stream_events(messages, True, transcript, reservation)):
+        if isinstance(event, str):
+            yield text_frame(event)
+        else:
+            yield event
+
+
+async def save_session(body, key: str, history: List[dict], transcript: List[dict]):
+    # Only a completed response is saved; an interrupted one leaves the
+    # session as it was, and the client can resend the full history.
+    async for frame in body:
+        yield frame
+
+    await sessions.save(key, history + transcript)
 
 
 @app.post("/api/chat")
-async def handle_chat_data(request: Request, protocol: str = Query('data')):
-    messages = request.messages
-    openai_messages = convert_to_openai_messages(messages)
+async def handle_chat_data(
+    request: Request,
+    http_request: HTTPRequest,
+    protocol: Literal['data', 'text'] = Query('data'),
+    accept_encoding: Optional[str] = Header(None),
+):
+    started = time.perf_counter()
+    requests_total.inc(label=protocol)
+
+    # Checked before anything is converted or sent upstream, so a rejection
+    # is cheap. The frontend looks for "Too many requests" in the error.
+    user = client_id(http_request)
+    try:
+        slot = await admission.acquire(user)
+    except Rejected as e:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests, please try again later",
+            headers={"Retry-After": retry_after_header(e.retry_after)})
+
+    # Backdated so the request span covers validation and the admission wait.
+    root = start_span("chat.request", start=request._validation_started, protocol=protocol)
+    record_span("chat.validate", request._validation_started, request._validation_seconds)
+
+    try:
+        use_session = sessions is not None and request.id
+        transcript = [] if use_session else None
+        chat = session_key(user, request.id) if use_session else None
+
+        # Loading may download the tokenizer; never on the event loop.
+        await load_tokenizer()
+
+        with span("chat.convert", messages=len(request.messages)):
+            if use_session:
+                if request.messages:
+                    history = convert_to_openai_messages(
+                        request.messages, available_tools, token_budget=0)
+                else:
+                    history = await sessions.load(chat)
+                    if history is None:
+                        raise HTTPException(
+                            status_code=404,
+                            detail="Unknown chat id, send the full message history")
+
+                if request.message is not None:
+                    history += convert_to_openai_messages(
+                        [request.message], available_tools, token_budget=0)
+
+            else:
+                history = request.messages
+                if request.message is not None:
+                    history = history + [request.message]
+
+                history = convert_to_openai_messages(
+                    history, available_tools, token_budget=0)
+
+            # Counted once, for both compaction and the quota estimate.
+            openai_messages, prompt_tokens = fit_messages(history)
+
+        try:
+            reservation = quota.reserve(user, estimate_tokens(
+                prompt_tokens, available_tools.schemas_json if protocol == 'data' else ""))
+        except QuotaExceeded as e:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests, token quota exceeded, please try again later",
+                headers={"Retry-After": retry_after_header(e.retry_after)})
+
+        body = stream_text(openai_messages, protocol, transcript, reservation)
+        if use_session:
+            body = save_session(body, chat, history, transcript)
+
+    except BaseException:
+        root.end()
+        slot.release()
+        raise
+
+    # The body runs in another task; `trace_stream` makes `root` current
+    # there, and it must not stay current here for later requests.
+    root.detach()
+
+    headers = {}
+
+    encoding = negotiate_encoding(accept_encoding)
+    if encoding:
+        body = compress_stream(body, encoding)
+        headers['content-encoding'] = encoding
+        headers['vary'] = 'accept-encoding'
+
+    body = trace_stream(observe_stream(body, started), root)
+
+    if should_profile(http_request.headers.get('x-profile')):
+        profile = new_profile()
+        body = profile_stream(body, profile)
+        headers['x-profile-file'] = os.path.basename(profile.path)
+
+    body = hold(cancel_on_disconnect(body, http_request.is_disconnected), slot)
+    # Releases the slot too if the client is gone before streaming starts,
+    # when `hold` never runs.
+    background = BackgroundTask(slot.release)
+
+    if protocol == 'text':
+        return StreamingResponse(
+            body, headers=headers, media_type='text/plain; charset=utf-8',
+            background=background)
+
+    headers['x-vercel-ai-data-stream'] = 'v1'
+    return StreamingResponse(body, headers=headers, background=background)
+
 
-    response = StreamingResponse(stream_text(openai_messages, protocol))
-    response.headers['x-vercel-ai-data-stream'] = 'v1'
-    return response
+@app.get("/api/metrics")
+async def handle_metrics():
+    return PlainTextResponse(
+        metrics.render(), media_type='text/plain; version=0.0.4')
@@ -0,0 +1,198 @@
+"""
+Admission control for /api/chat.
+
+A request has to pass two gates: a token bucket per client, refilled at
+ADMISSION_CLIENT_RATE requests per second up to ADMISSION_CLIENT_BURST, and
+a limit of ADMISSION_MAX_STREAMS concurrent streams. When every stream slot
+is taken, up to ADMISSION_MAX_QUEUE requests wait at most
+ADMISSION_QUEUE_TIMEOUT seconds for one to free up. Anything beyond that is
+turned away at once, so overload sheds requests instead of slowing every
+stream down. A rate or limit of 0 disables that gate.
+
+The per-client bucket is only on by default when clients can be told apart:
+on Vercel, or when ADMISSION_TRUST_FORWARDED is set behind another proxy.
+"""
+import os
+import math
+import time
+import asyncio
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Dict, Optional
+
+
+# Behind Vercel's proxy every request comes from the proxy; the client is
+# the first address in X-Forwarded-For. Anywhere else clients can set that
+# header themselves, so it's only trusted on Vercel unless configured.
+ADMISSION_TRUST_FORWARDED = os.environ.get(
+    "ADMISSION_TRUST_FORWARDED", "1" if os.environ.get("VERCEL") else "0") == "1"
+# Without a trusted address, behind a proxy every user would share one bucket.
+ADMISSION_CLIENT_RATE = float(os.environ.get(
+    "ADMISSION_CLIENT_RATE", "0.5" if ADMISSION_TRUST_FORWARDED else "0"))
+ADMISSION_CLIENT_BURST = float(os.environ.get("ADMISSION_CLIENT_BURST", "10"))
+ADMISSION_MAX_CLIENTS = int(os.environ.get("ADMISSION_MAX_CLIENTS", "10000"))
+ADMISSION_MAX_STREAMS = int(os.environ.get("ADMISSION_MAX_STREAMS", "100"))
+ADMISSION_MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", "100"))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "10"))
+# Retry-After sent when the server, rather than the client, is the limit.
+ADMISSION_RETRY_AFTER = float(os.environ.get("ADMISSION_RETRY_AFTER", "5"))
+
+
+class Rejected(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Take a token. Returns 0, or the seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+
+        return (1 - self.tokens) / self.rate
+
+
+class Slot:
+    """A stream slot, released once however many times `release` is called."""
+
+    def __init__(self, controller: Optional["AdmissionController"]):
+        self._controller = controller
+
+    def release(self):
+        if self._controller is not None:
+            controller, self._controller = self._controller, None
+            controller._release()
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        client_rate: float = ADMISSION_CLIENT_RATE,
+        client_burst: float = ADMISSION_CLIENT_BURST,
+        max_streams: int = ADMISSION_MAX_STREAMS,
+        max_queue: int = ADMISSION_MAX_QUEUE,
+        queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+        max_clients: int = ADMISSION_MAX_CLIENTS,
+    ):
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.max_streams = max_streams
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_clients = max_clients
+
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._active = 0
+        self._waiters: "deque[asyncio.Future]" = deque()
+        self._counts = {"admitted": 0, "queued": 0, "rejected_rate": 0, "rejected_queue_full": 0, "rejected_timeout": 0}
+
+    def _bucket(self, client: str) -> TokenBucket:
+        bucket = self._buckets.get(client)
+
+        if bucket is None:
+            bucket = self._buckets[client] = TokenBucket(self.client_rate, self.client_burst)
+            # A forgotten client just starts again with a full bucket.
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+
+        return bucket
+
+    def _reject(self, reason: str, retry_after: float):
+        self._counts[f"rejected_{reason}"] += 1
+        raise Rejected(reason, retry_after)
+
+    async def acquire(self, client: str) -> Slot:
+        """Wait for a stream slot for `client`, or raise `Rejected`."""
+        if self.client_rate > 0:
+            wait = self._bucket(client).take()
+            if wait > 0:
+                self._reject("rate", wait)
+
+        if self.max_streams <= 0:
+            self._counts["admitted"] += 1
+            return Slot(None)
+
+        if self._active < self.max_streams and not self._waiters:
+            self._active += 1
+            self._counts["admitted"] += 1
+            return Slot(self)
+
+        if len(self._waiters) >= self.max_queue:
+            self._reject("queue_full", ADMISSION_RETRY_AFTER)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._counts["queued"] += 1
+
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the wait was cancelled.
+                self._release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+            if isinstance(e, asyncio.TimeoutError):
+                self._reject("timeout", ADMISSION_RETRY_AFTER)
+            raise
+
+        self._counts["admitted"] += 1
+        return Slot(self)
+
+    def _release(self):
+        # Hand the slot straight to the oldest waiter, if any is left.
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+        self._active -= 1
+
+    # The stats that only ever go up.
+    counter_stats = ("admitted", "queued", "rejected_rate", "rejected_queue_full", "rejected_timeout")
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "active": self._active,
+            "waiting": len(self._waiters),
+            "clients": len(self._buckets),
+            **self._counts,
+        }
+
+
+def client_id(request) -> str:
+    if ADMISSION_TRUST_FORWARDED:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+
+    return request.client.host if request.client else "unknown"
+
+
+def retry_after_header(seconds: float) -> str:
+    return str(max(1, math.ceil(seconds)))
+
+
+async def hold(body: AsyncIterator[bytes], slot: Slot) -> AsyncIterator[bytes]:
+    """Keep `slot` for as long as the response streams."""
+    try:
+        async for frame in body:
+            yield frame
+    finally:
+        slot.release()
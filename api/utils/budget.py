@@ -0,0 +1,165 @@
+import os
+import json
+import asyncio
+from typing import Callable, List, Optional, Tuple
+
+
+# Upper bound on the prompt sent upstream, and how many of the most recent
+# messages are always sent verbatim regardless of the budget.
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", "16000"))
+PROMPT_KEEP_RECENT = int(os.environ.get("PROMPT_KEEP_RECENT", "6"))
+
+# Per-message framing overhead and a flat cost per image, as billed by OpenAI
+# for gpt-4o (images assume high detail at 1024x1024).
+MESSAGE_OVERHEAD_TOKENS = 4
+IMAGE_TOKENS = 765
+
+ELIDED_TOOL_RESULT = json.dumps(
+    "Result omitted to save space; call the tool again if it is needed.")
+
+_count: Optional[Callable[[str], int]] = None
+
+
+def _load_tokenizer() -> Callable[[str], int]:
+    # tiktoken is optional and not in requirements.txt: it pulls in requests
+    # and downloads its BPE file on first use, which a cold serverless
+    # instance can't afford. Without it, counts are estimated.
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding("o200k_base")
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+    except Exception:
+        # No local tokenizer: about four characters per token for English.
+        return lambda text: (len(text) + 3) // 4
+
+
+async def load_tokenizer():
+    """Load the tokenizer off the event loop; loading may hit the network."""
+    global _count
+
+    if _count is None:
+        count = await asyncio.to_thread(_load_tokenizer)
+        if _count is None:
+            _count = count
+
+
+def count_tokens(text: str) -> int:
+    global _count
+
+    if _count is None:
+        _count = _load_tokenizer()
+
+    return _count(text)
+
+
+def message_tokens(message: dict) -> int:
+    tokens = MESSAGE_OVERHEAD_TOKENS
+    content = message.get("content")
+
+    if isinstance(content, str):
+        tokens += count_tokens(content)
+
+    elif content:
+        for part in content:
+            if part.get("type") == "text":
+                tokens += count_tokens(part["text"])
+            elif part.get("type") == "image_url":
+                tokens += IMAGE_TOKENS
+
+    for tool_call in message.get("tool_calls") or ():
+        function = tool_call["function"]
+        tokens += count_tokens(function["name"]) + count_tokens(function["arguments"])
+
+    return tokens
+
+
+def _groups(messages: List[dict]) -> List[List[int]]:
+    # Indices of messages that must be kept or dropped together: an
+    # assistant message with tool calls and the tool results that answer it.
+    groups = []
+
+    for index, message in enumerate(messages):
+        if message.get("role") == "tool" and groups:
+            groups[-1].append(index)
+        else:
+            groups.append([index])
+
+    return groups
+
+
+def compact_messages(
+    messages: List[dict],
+    budget: Optional[int] = None,
+    keep_recent: Optional[int] = None,
+) -> List[dict]:
+    """
+    Fit a converted conversation into a prompt token budget.
+
+    The last `keep_recent` messages are always kept verbatim. Older tool
+    results are elided first, then the oldest turns are dropped until the
+    prompt fits. System messages are never dropped. The input messages are
+    never modified, because they may be shared with a cache.
+    """
+    if budget is None:
+        budget = PROMPT_TOKEN_BUDGET
+
+    if budget <= 0:
+        return messages
+
+    return fit_messages(messages, budget, keep_recent)[0]
+
+
+def fit_messages(
+    messages: List[dict],
+    budget: Optional[int] = None,
+    keep_recent: Optional[int] = None,
+) -> Tuple[List[dict], int]:
+    """`compact_messages`, also returning the prompt tokens of the result."""
+    if budget is None:
+        budget = PROMPT_TOKEN_BUDGET
+    if keep_recent is None:
+        keep_recent = PROMPT_KEEP_RECENT
+
+    tokens = [message_tokens(message) for message in messages]
+    total = sum(tokens)
+
+    if budget <= 0 or total <= budget:
+        return messages, total
+
+    groups = _groups(messages)
+    recent_start = max(len(messages) - keep_recent, 0)
+    # Never split a tool call from its results at the window boundary.
+    for group in groups:
+        if group[0] < recent_start <= group[-1]:
+            recent_start = group[0]
+
+    compacted = list(messages)
+    elided_tokens = MESSAGE_OVERHEAD_TOKENS + count_tokens(ELIDED_TOOL_RESULT)
+
+    for index in range(recent_start):
+        if total <= budget:
+            break
+
+        message = compacted[index]
+        if message.get("role") == "tool" and tokens[index] > elided_tokens:
+            compacted[index] = {**message, "content": ELIDED_TOOL_RESULT}
+            total -= tokens[index] - elided_tokens
+            tokens[index] = elided_tokens
+
+    dropped = set()
+
+    for group in groups:
+        if total <= budget or group[0] >= recent_start:
+            break
+
+        if compacted[group[0]].get("role") == "system":
+            continue
+
+        dropped.update(group)
+        total -= sum(tokens[index] for index in group)
+
+    if not dropped:
+        return compacted, total
+
+    return [message for index, message in enumerate(compacted) if index not in dropped], total
@@ -0,0 +1,189 @@
+import json
+import time
+import asyncio
+import functools
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash(latitude: float, longitude: float, precision: int = 5) -> str:
+    """
+    Standard geohash of a coordinate. Precision 5 is a cell of roughly
+    5km x 5km, which is well below the resolution of a weather forecast.
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+
+    while len(chars) < precision:
+        if even:
+            value, bounds = longitude, lon_range
+        else:
+            value, bounds = latitude, lat_range
+
+        middle = (bounds[0] + bounds[1]) / 2
+        if value >= middle:
+            bits = (bits << 1) | 1
+            bounds[0] = middle
+        else:
+            bits = bits << 1
+            bounds[1] = middle
+
+        even = not even
+        bit_count += 1
+
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits = 0
+            bit_count = 0
+
+    return "".join(chars)
+
+
+class TTLCache:
+    """
+    LRU cache with a time-to-live and a memory cap.
+
+    Entries younger than `ttl` are fresh. Entries between `ttl` and
+    `ttl + stale_ttl` are still served, but the caller should revalidate
+    them in the background. The memory cap uses the JSON size of each value
+    as an estimate.
+    """
+
+    def __init__(self, ttl: float, stale_ttl: float = 0, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int, float]]" = OrderedDict()
+        self._bytes = 0
+        self._refreshing: Dict[Hashable, asyncio.Task] = {}
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def get(self, key: Hashable) -> Optional[Tuple[Any, bool]]:
+        """Return `(value, is_fresh)`, or `None` when missing or expired."""
+        entry = self._entries.get(key)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        value, size, stored_at = entry
+        age = time.monotonic() - stored_at
+
+        if age > self.ttl + self.stale_ttl:
+            self._remove(key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+
+        if age > self.ttl:
+            self.stale_hits += 1
+            return value, False
+
+        self.hits += 1
+        return value, True
+
+    def set(self, key: Hashable, value: Any, size: Optional[int] = None):
+        if size is None:
+            size = len(json.dumps(value))
+
+        if size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+
+        self._entries[key] = (value, size, time.monotonic())
+        self._bytes += size
+
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def revalidate(self, key: Hashable, load: Callable[[], Awaitable[Any]]):
+        """Refresh a stale entry in the background, at most once per key."""
+        if key in self._refreshing:
+            return
+
+        async def refresh():
+            try:
+                value = await load()
+                if value is not None:
+                    self.set(key, value)
+            finally:
+                del self._refreshing[key]
+
+        self._refreshing[key] = asyncio.ensure_future(refresh())
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    # The stats that only ever go up.
+    counter_stats = ("hits", "stale_hits", "misses", "evictions")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+        }
+
+    def _remove(self, key: Hashable):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+
+def cached(cache: TTLCache, key: Callable[..., Hashable]):
+    """
+    Cache the results of an async function in `cache`. `key` receives the
+    same arguments as the function. `None` results are not cached, so a
+    failed call is retried on the next request.
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            cache_key = key(*args, **kwargs)
+            entry = cache.get(cache_key)
+
+            if entry is not None:
+                value, is_fresh = entry
+                if not is_fresh:
+                    cache.revalidate(
+                        cache_key, lambda: function(*args, **kwargs))
+                return value
+
+            value = await function(*args, **kwargs)
+            if value is not None:
+                cache.set(cache_key, value)
+
+            return value
+
+        wrapper.cache = cache
+        return wrapper
+
+    return decorator
@@ -0,0 +1,111 @@
+import os
+import asyncio
+from typing import AsyncIterator, Optional, Union
+
+
+# Text deltas are merged until the buffer holds this many characters or the
+# oldest buffered delta has waited this long, whichever comes first.
+STREAM_COALESCE_CHARS = int(os.environ.get("STREAM_COALESCE_CHARS", "512"))
+STREAM_COALESCE_MS = float(os.environ.get("STREAM_COALESCE_MS", "15"))
+
+# How many events the upstream may run ahead of the response writer.
+_READ_AHEAD = 64
+
+
+class _End:
+    def __init__(self, error: Optional[BaseException] = None):
+        self.error = error
+
+
+async def coalesce_text(
+    events: AsyncIterator[Union[str, bytes]],
+    max_chars: Optional[int] = None,
+    max_delay: Optional[float] = None,
+) -> AsyncIterator[Union[str, bytes]]:
+    """
+    Merge consecutive text deltas (`str` events) into fewer, larger ones.
+    Any other event is passed through after flushing the buffered text, so
+    ordering is preserved. The first delta is never held back, so time to
+    first token is unchanged.
+    """
+    if max_chars is None:
+        max_chars = STREAM_COALESCE_CHARS
+    if max_delay is None:
+        max_delay = STREAM_COALESCE_MS / 1000
+
+    if max_delay <= 0:
+        async for event in events:
+            yield event
+        return
+
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(_READ_AHEAD)
+
+    # The upstream is read by its own task so that a burst of deltas can be
+    # drained from the queue without waiting, and a timer only runs when
+    # the buffer is waiting on a slow upstream.
+    async def read():
+        try:
+            async for event in events:
+                await queue.put(event)
+        except Exception as e:
+            await queue.put(_End(e))
+        else:
+            await queue.put(_End())
+
+    reader = asyncio.ensure_future(read())
+    buffer = []
+    size = 0
+    deadline = 0.0
+    first_text = True
+
+    try:
+        while True:
+            if buffer and queue.empty():
+                try:
+                    event = await asyncio.wait_for(
+                        queue.get(), max(deadline - loop.time(), 0))
+                except asyncio.TimeoutError:
+                    yield "".join(buffer)
+                    buffer.clear()
+                    size = 0
+                    continue
+            else:
+                event = await queue.get()
+
+            if isinstance(event, str):
+                if first_text:
+                    first_text = False
+                    yield event
+                    continue
+
+                if not buffer:
+                    deadline = loop.time() + max_delay
+
+                buffer.append(event)
+                size += len(event)
+
+                if size >= max_chars or loop.time() >= deadline:
+                    yield "".join(buffer)
+                    buffer.clear()
+                    size = 0
+                continue
+
+            if buffer:
+                yield "".join(buffer)
+                buffer.clear()
+                size = 0
+
+            if isinstance(event, _End):
+                if event.error is not None:
+                    raise event.error
+                break
+
+            yield event
+
+    finally:
+        reader.cancel()
+        try:
+            await reader
+        except asyncio.CancelledError:
+            pass
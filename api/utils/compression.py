@@ -0,0 +1,124 @@
+import os
+import zlib
+from typing import AsyncIterator, Dict, Optional
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Opt-in list of encodings the server may use, in order of preference,
+# e.g. "zstd,br,gzip". Empty disables response compression.
+STREAM_COMPRESSION = os.environ.get("STREAM_COMPRESSION", "")
+STREAM_COMPRESSION_LEVEL = int(os.environ.get("STREAM_COMPRESSION_LEVEL", "5"))
+
+
+class _Gzip:
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class _Brotli:
+    def __init__(self, level: int):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class _Zstd:
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+_COMPRESSORS = {"gzip": _Gzip}
+if brotli is not None:
+    _COMPRESSORS["br"] = _Brotli
+if zstandard is not None:
+    _COMPRESSORS["zstd"] = _Zstd
+
+
+def _accepted_encodings(accept_encoding: str) -> Dict[str, float]:
+    accepted = {}
+
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+
+        if name:
+            accepted[name.strip().lower()] = quality
+
+    return accepted
+
+
+def negotiate_encoding(accept_encoding: Optional[str], enabled: Optional[str] = None) -> Optional[str]:
+    """
+    Pick the encoding for a response: the enabled encoding with the highest
+    client quality (ties go to the server's order), or `None` to send the
+    response uncompressed.
+    """
+    if enabled is None:
+        enabled = STREAM_COMPRESSION
+
+    if not enabled or not accept_encoding:
+        return None
+
+    accepted = _accepted_encodings(accept_encoding)
+    best = None
+    best_quality = 0.0
+
+    for name in enabled.split(","):
+        name = name.strip().lower()
+        if name not in _COMPRESSORS:
+            continue
+
+        quality = accepted.get(name, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best = name
+            best_quality = quality
+
+    return best
+
+
+async def compress_stream(frames: AsyncIterator[bytes], encoding: str, level: int = STREAM_COMPRESSION_LEVEL) -> AsyncIterator[bytes]:
+    """
+    Compress a stream frame by frame. Every frame is flushed on its own so
+    the client can decode it as soon as it arrives.
+    """
+    compressor = _COMPRESSORS[encoding](level)
+
+    async for frame in frames:
+        data = compressor.compress(frame)
+        if data:
+            yield data
+
+    yield compressor.finish()
@@ -0,0 +1,71 @@
+"""
+Encoder for the AI SDK data stream protocol:
+https://sdk.vercel.ai/docs/ai-sdk-ui/stream-protocol#data-stream-protocol
+
+Every frame is `<type>:<json>\n`. Frames are returned as bytes so they can
+be written to the response as is.
+"""
+import json
+from typing import Any
+
+try:
+    import orjson
+
+    def dumps(value: Any) -> bytes:
+        return orjson.dumps(value)
+
+    loads = orjson.loads
+
+except ImportError:
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+    def dumps(value: Any) -> bytes:
+        return _encoder.encode(value).encode()
+
+    loads = json.loads
+
+
+TEXT = b"0:"
+TOOL_CALL = b"9:"
+TOOL_RESULT = b"a:"
+FINISH_STEP = b"e:"
+NEWLINE = b"\n"
+
+_FINISH_STEP_HEAD = {
+    reason: FINISH_STEP + b'{"finishReason":' + dumps(reason) + b',"usage":{"promptTokens":'
+    for reason in ("stop", "tool-calls", "length", "content-filter", "error", "other")
+}
+_FINISH_STEP_TAIL = b',"completionTokens":%d},"isContinued":%s}\n'
+
+
+def text_frame(text: str) -> bytes:
+    return TEXT + dumps(text) + NEWLINE
+
+
+def tool_call_frame(tool_call_id: str, tool_name: str, args: Any) -> bytes:
+    return TOOL_CALL + dumps({
+        "toolCallId": tool_call_id,
+        "toolName": tool_name,
+        "args": args,
+    }) + NEWLINE
+
+
+def tool_result_frame(tool_call_id: str, tool_name: str, args: Any, result: Any) -> bytes:
+    return TOOL_RESULT + dumps({
+        "toolCallId": tool_call_id,
+        "toolName": tool_name,
+        "args": args,
+        "result": result,
+    }) + NEWLINE
+
+
+def finish_step_frame(reason: str, prompt_tokens: int, completion_tokens: int, is_continued: bool = False) -> bytes:
+    head = _FINISH_STEP_HEAD.get(reason)
+    if head is None:
+        head = FINISH_STEP + b'{"finishReason":' + dumps(reason) + b',"usage":{"promptTokens":'
+
+    return b"%s%d%s" % (
+        head,
+        prompt_tokens or 0,
+        _FINISH_STEP_TAIL % (completion_tokens or 0, b"true" if is_continued else b"false"),
+    )
@@ -0,0 +1,79 @@
+"""
+Stop a response as soon as its client goes away.
+
+Starlette cancels a streaming response when the server passes on the
+client's disconnect, but not every server or proxy does so while the
+response is still being written. `cancel_on_disconnect` also polls for the
+disconnect, and then cancels whatever the body is waiting on: the OpenAI
+stream, or pending tool calls. Unwinding the body closes the upstream
+response, so no more tokens are generated for nobody.
+"""
+import os
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from .metrics import client_disconnects_total
+
+
+# 0 leaves disconnects to the server and Starlette.
+DISCONNECT_POLL_MS = float(os.environ.get("DISCONNECT_POLL_MS", "250"))
+
+
+async def cancel_on_disconnect(
+    body: AsyncIterator[bytes],
+    is_disconnected: Callable[[], Awaitable[bool]],
+    interval: Optional[float] = None,
+) -> AsyncIterator[bytes]:
+    interval = DISCONNECT_POLL_MS / 1000 if interval is None else interval
+    task = asyncio.current_task()
+    iterator = body.__aiter__()
+    waiting = False
+    disconnected = False
+    finished = False
+
+    async def watch():
+        nonlocal disconnected
+        while not await is_disconnected():
+            await asyncio.sleep(interval)
+
+        disconnected = True
+        # Only interrupt the body itself; while a frame is being sent the
+        # loop below stops once the send returns.
+        if waiting:
+            task.cancel()
+
+    watcher = asyncio.create_task(watch()) if interval > 0 else None
+
+    try:
+        while not disconnected:
+            waiting = True
+            try:
+                frame = await iterator.__anext__()
+            except StopAsyncIteration:
+                finished = True
+                return
+            finally:
+                waiting = False
+
+            yield frame
+
+    except asyncio.CancelledError:
+        if not disconnected:
+            raise
+        # Before 3.11 tasks don't count cancellations; nothing to undo.
+        if hasattr(task, "uncancel"):
+            task.uncancel()
+
+    except Exception:
+        finished = True
+        raise
+
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+
+        # Neither completed nor failed: cancelled, or closed early by the server.
+        if not finished:
+            client_disconnects_total.inc()
+
+        await iterator.aclose()
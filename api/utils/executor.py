@@ -0,0 +1,106 @@
+import os
+import json
+import time
+import asyncio
+import inspect
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, List, Tuple
+from .singleflight import SingleFlight
+from .metrics import tool_seconds
+from .tracing import span
+from .data_stream import loads
+
+
+TOOL_TIMEOUT = float(os.environ.get("TOOL_TIMEOUT", "10"))
+TOOL_MAX_WORKERS = int(os.environ.get("TOOL_MAX_WORKERS", "8"))
+
+# Synchronous tools run here so they never block the event loop, and so a
+# burst of tool calls can't take over the threads Starlette relies on.
+tool_pool = ThreadPoolExecutor(
+    max_workers=TOOL_MAX_WORKERS, thread_name_prefix="tool")
+
+# Identical calls (same tool, same arguments) that overlap in time share one
+# upstream request and one result.
+tool_flights = SingleFlight()
+
+
+def parse_arguments(tool_call: dict) -> dict:
+    """
+    Decode a drafted call's JSON arguments into `tool_call["args"]`, once.
+    Malformed or truncated model output leaves `{}` and an `"error"`, and
+    the call then fails like any other.
+    """
+    if "args" not in tool_call:
+        try:
+            args = loads(tool_call["arguments"] or "{}")
+            if not isinstance(args, dict):
+                raise ValueError(f"expected an object, got {type(args).__name__}")
+            tool_call["args"] = args
+        except ValueError as e:
+            tool_call["args"] = {}
+            tool_call["error"] = f"invalid arguments: {e}"
+
+    return tool_call["args"]
+
+
+async def run_tool(function: Callable, arguments: Dict[str, Any], timeout: float = TOOL_TIMEOUT):
+    if inspect.iscoroutinefunction(function):
+        call = function(**arguments)
+    else:
+        loop = asyncio.get_running_loop()
+        call = loop.run_in_executor(
+            tool_pool, functools.partial(function, **arguments))
+
+    return await asyncio.wait_for(call, timeout)
+
+
+async def execute_tool_calls(
+    tool_calls: List[dict],
+    tools: Dict[str, Callable],
+    timeout: float = TOOL_TIMEOUT,
+) -> AsyncIterator[Tuple[dict, Any]]:
+    """
+    Run all drafted tool calls concurrently and yield `(tool_call, result)`
+    pairs in completion order. A failed or timed out call yields `None`,
+    like a tool that handled its own error.
+    """
+
+    async def execute(tool_call):
+        try:
+            function = tools[tool_call["name"]]
+            arguments = parse_arguments(tool_call)
+            if "error" in tool_call:
+                raise ValueError(tool_call["error"])
+
+            key = (tool_call["name"], json.dumps(arguments, sort_keys=True))
+
+            started = time.perf_counter()
+            try:
+                with span(f"tool.{tool_call['name']}", tool_call_id=tool_call["id"]):
+                    result = await tool_flights.do(
+                        key, lambda: run_tool(function, arguments, timeout))
+            finally:
+                tool_seconds.observe(
+                    time.perf_counter() - started, tool_call["name"])
+
+            return tool_call, result
+
+        except asyncio.TimeoutError:
+            print(f"Tool {tool_call['name']} timed out after {timeout}s")
+
+        except Exception as e:
+            print(f"Error running tool {tool_call['name']}: {e!r}")
+
+        return tool_call, None
+
+    tasks = [asyncio.ensure_future(execute(tool_call))
+             for tool_call in tool_calls]
+
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            yield await next_result
+
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,153 @@
+"""
+A local stand-in for the OpenAI streaming API, for load tests and
+benchmarks that must not reach the network or spend tokens.
+
+Recordings are JSONL files. Each line is one response:
+
+    {"trigger": "user" | "tool", "chunks": [<ChatCompletionChunk>, ...]}
+
+`trigger` says which turn the response answers: a new user message, or
+the results of a tool call. Matching responses are replayed round-robin.
+"""
+import os
+import json
+import asyncio
+import itertools
+from typing import TYPE_CHECKING, Dict, Iterator, List
+
+if TYPE_CHECKING:
+    from openai.types.chat import ChatCompletionChunk
+
+
+# Replay recordings from this file instead of calling OpenAI.
+OPENAI_FAKE = os.environ.get("OPENAI_FAKE", "")
+# Append every real response to this file, to build a recording.
+OPENAI_RECORD = os.environ.get("OPENAI_RECORD", "")
+OPENAI_FAKE_TTFT_MS = float(os.environ.get("OPENAI_FAKE_TTFT_MS", "300"))
+OPENAI_FAKE_DELAY_MS = float(os.environ.get("OPENAI_FAKE_DELAY_MS", "20"))
+
+
+def _trigger(messages: List[dict]) -> str:
+    return "tool" if messages and messages[-1].get("role") == "tool" else "user"
+
+
+class FakeStream:
+    def __init__(self, chunks: List["ChatCompletionChunk"], ttft: float, delay: float):
+        self._chunks = chunks
+        self._ttft = ttft
+        self._delay = delay
+        self._closed = False
+
+    async def __aiter__(self):
+        if self._ttft > 0:
+            await asyncio.sleep(self._ttft)
+
+        for index, chunk in enumerate(self._chunks):
+            if self._closed:
+                return
+            if index and self._delay > 0:
+                await asyncio.sleep(self._delay)
+            yield chunk
+
+    async def close(self):
+        self._closed = True
+
+
+class _FakeCompletions:
+    def __init__(self, responses: Dict[str, Iterator[List["ChatCompletionChunk"]]], ttft: float, delay: float):
+        self._responses = responses
+        self._ttft = ttft
+        self._delay = delay
+        self.calls = 0
+
+    async def create(self, messages: List[dict], stream: bool = False, **kwargs) -> FakeStream:
+        if not stream:
+            raise NotImplementedError("The fake OpenAI backend only streams")
+
+        self.calls += 1
+        responses = self._responses.get(_trigger(messages)) or self._responses["user"]
+        return FakeStream(next(responses), self._ttft, self._delay)
+
+
+class _Namespace:
+    pass
+
+
+class FakeAsyncOpenAI:
+    """Replays recorded responses through the `chat.completions.create` API."""
+
+    def __init__(self, path: str, ttft_ms: float = OPENAI_FAKE_TTFT_MS, delay_ms: float = OPENAI_FAKE_DELAY_MS):
+        from openai.types.chat import ChatCompletionChunk
+
+        recorded: Dict[str, List[List[ChatCompletionChunk]]] = {}
+
+        with open(path) as file:
+            for line in file:
+                if not line.strip():
+                    continue
+
+                response = json.loads(line)
+                recorded.setdefault(response.get("trigger", "user"), []).append([
+                    ChatCompletionChunk.model_validate(chunk)
+                    for chunk in response["chunks"]
+                ])
+
+        if "user" not in recorded:
+            raise ValueError(f"{path} has no response to a user message")
+
+        self.chat = _Namespace()
+        self.chat.completions = _FakeCompletions(
+            {trigger: itertools.cycle(responses)
+             for trigger, responses in recorded.items()},
+            ttft_ms / 1000,
+            delay_ms / 1000,
+        )
+
+
+class _RecordingStream:
+    def __init__(self, stream, path: str, trigger: str):
+        self._stream = stream
+        self._path = path
+        self._trigger = trigger
+
+    async def __aiter__(self):
+        chunks = []
+
+        async for chunk in self._stream:
+            chunks.append(chunk.model_dump(mode="json", exclude_unset=True))
+            yield chunk
+
+        line = json.dumps({"trigger": self._trigger, "chunks": chunks})
+        with open(self._path, "a") as file:
+            file.write(line + "\n")
+
+    async def close(self):
+        await self._stream.close()
+
+
+class _RecordingCompletions:
+    def __init__(self, completions, path: str):
+        self._completions = completions
+        self._path = path
+
+    async def create(self, messages: List[dict], stream: bool = False, **kwargs):
+        response = await self._completions.create(
+            messages=messages, stream=stream, **kwargs)
+
+        if not stream:
+            return response
+
+        return _RecordingStream(response, self._path, _trigger(messages))
+
+
+class RecordingAsyncOpenAI:
+    """Wraps a real client and appends every streamed response to `path`."""
+
+    def __init__(self, client, path: str):
+        self._client = client
+        self.chat = _Namespace()
+        self.chat.completions = _RecordingCompletions(
+            client.chat.completions, path)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
@@ -0,0 +1,123 @@
+import os
+import asyncio
+import importlib.util
+from typing import TYPE_CHECKING, Dict, Optional
+
+if TYPE_CHECKING:
+    import httpx
+
+# Checked without importing h2; httpx imports it when the pool first
+# opens an HTTP/2 connection.
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.environ.get("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", "10"))
+
+# The OpenAI pool. Completions stream for many seconds, so it needs more
+# connections kept alive than the tools do. With HTTP/2 they are all
+# multiplexed over a handful of connections instead.
+UPSTREAM_HTTP2 = os.environ.get("UPSTREAM_HTTP2", "1") == "1" and HTTP2_AVAILABLE
+UPSTREAM_MAX_CONNECTIONS = int(os.environ.get("UPSTREAM_MAX_CONNECTIONS", "200"))
+UPSTREAM_MAX_KEEPALIVE = int(os.environ.get("UPSTREAM_MAX_KEEPALIVE", "50"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.environ.get("UPSTREAM_KEEPALIVE_EXPIRY", "60"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", "5"))
+UPSTREAM_TIMEOUT = float(os.environ.get("UPSTREAM_TIMEOUT", "600"))
+# Connections opened when the server starts; 0 disables the warm-up.
+UPSTREAM_WARMUP_CONNECTIONS = int(os.environ.get("UPSTREAM_WARMUP_CONNECTIONS", "1"))
+
+_client: Optional["httpx.AsyncClient"] = None
+
+
+def get_http_client() -> "httpx.AsyncClient":
+    """
+    Process-wide pooled client shared by every tool, so repeated calls to the
+    same host reuse a warm keep-alive connection instead of a new TLS session.
+    """
+    global _client
+
+    if _client is None or _client.is_closed:
+        import httpx
+
+        _client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            timeout=HTTP_TIMEOUT,
+        )
+
+    return _client
+
+
+async def close_http_client():
+    global _client
+
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def create_upstream_client() -> "httpx.AsyncClient":
+    """The transport handed to `AsyncOpenAI(http_client=...)`."""
+    import httpx
+
+    return httpx.AsyncClient(
+        http2=UPSTREAM_HTTP2,
+        limits=httpx.Limits(
+            max_connections=UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+            keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(UPSTREAM_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT),
+        follow_redirects=True,
+    )
+
+
+async def warm_up(client: "httpx.AsyncClient", url: str, connections: int = UPSTREAM_WARMUP_CONNECTIONS):
+    """
+    Open `connections` connections to `url` so the first requests skip the
+    TCP and TLS handshakes. Any response will do, so a HEAD is enough.
+    """
+    import httpx
+
+    async def connect():
+        try:
+            await client.head(url)
+        except httpx.HTTPError as e:
+            print(f"Error warming up connection to {url}: {e}")
+
+    # Concurrent requests each need their own HTTP/1.1 connection; over
+    # HTTP/2 they share one.
+    await asyncio.gather(*(connect() for _ in range(connections)))
+
+
+def pool_stats(client: Optional["httpx.AsyncClient"]) -> Dict[str, float]:
+    """Connection pool utilization of `client`, for the metrics endpoint."""
+    stats = {"connections": 0, "http2_connections": 0, "active": 0, "idle": 0, "queued": 0}
+
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    if client is None or client.is_closed or pool is None:
+        return stats
+
+    for connection in pool.connections:
+        stats["connections"] += 1
+        if "HTTP/2" in connection.info():
+            stats["http2_connections"] += 1
+        if connection.is_idle():
+            stats["idle"] += 1
+        else:
+            stats["active"] += 1
+
+    stats["queued"] = sum(
+        1 for request in getattr(pool, "_requests", []) if request.is_queued())
+
+    return stats
+
+
+def http_pool_stats() -> Dict[str, float]:
+    return pool_stats(_client)
@@ -0,0 +1,156 @@
+"""
+In-process metrics rendered in the Prometheus text exposition format.
+
+Everything is updated from the event loop, so no locking is needed, and
+histograms use fixed buckets so an observation is one bisect and two adds.
+"""
+import time
+from bisect import bisect_left
+from typing import AsyncIterator, Callable, Collection, Dict, List, Optional, Sequence, Tuple
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+GAP_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, label: Optional[str] = None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self._values: Dict[str, float] = {}
+
+    def inc(self, amount: float = 1, label: str = ""):
+        self._values[label] = self._values.get(label, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+
+        for label, value in self._values.items():
+            labels = ((self.label, label),) if self.label else ()
+            lines.append(f"{self.name}{_format_labels(labels)} {value}")
+
+        return lines
+
+
+class _HistogramValues:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, size: int):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS, label: Optional[str] = None):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.label = label
+        self._values: Dict[str, _HistogramValues] = {}
+
+    def observe(self, value: float, label: str = ""):
+        values = self._values.get(label)
+        if values is None:
+            values = self._values[label] = _HistogramValues(len(self.buckets) + 1)
+
+        values.counts[bisect_left(self.buckets, value)] += 1
+        values.sum += value
+        values.count += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+
+        for label, values in self._values.items():
+            base = ((self.label, label),) if self.label else ()
+            cumulative = 0
+
+            for bound, count in zip(self.buckets, values.counts):
+                cumulative += count
+                labels = _format_labels(base + (("le", repr(float(bound))),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+
+            labels = _format_labels(base + (("le", "+Inf"),))
+            lines.append(f"{self.name}_bucket{labels} {values.count}")
+            lines.append(f"{self.name}_sum{_format_labels(base)} {values.sum}")
+            lines.append(f"{self.name}_count{_format_labels(base)} {values.count}")
+
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors: List[Tuple[str, Callable[[], Dict[str, float]], Collection[str]]] = []
+
+    def counter(self, name: str, help: str, label: Optional[str] = None) -> Counter:
+        metric = Counter(name, help, label)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS, label: Optional[str] = None) -> Histogram:
+        metric = Histogram(name, help, buckets, label)
+        self._metrics.append(metric)
+        return metric
+
+    def collect(self, prefix: str, stats: Callable[[], Dict[str, float]], counters: Collection[str] = ()):
+        """
+        Export a `stats()` dict, such as a cache's counters, at render time.
+        Stats named in `counters` only ever go up; the rest are gauges.
+        """
+        self._collectors.append((prefix, stats, frozenset(counters)))
+
+    def render(self) -> str:
+        lines = []
+
+        for metric in self._metrics:
+            lines.extend(metric.render())
+
+        for prefix, stats, counters in self._collectors:
+            for name, value in stats().items():
+                kind = "counter" if name in counters else "gauge"
+                lines.append(f"# TYPE {prefix}_{name} {kind}")
+                lines.append(f"{prefix}_{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = Registry()
+
+requests_total = metrics.counter(
+    "chat_requests_total", "Chat requests received", label="protocol")
+upstream_first_chunk_seconds = metrics.histogram(
+    "chat_upstream_first_chunk_seconds", "Time from calling the model to its first streamed chunk")
+first_frame_seconds = metrics.histogram(
+    "chat_first_frame_seconds", "Time from receiving a request to writing its first frame")
+inter_frame_seconds = metrics.histogram(
+    "chat_inter_frame_seconds", "Gap between consecutive frames written to a response", GAP_BUCKETS)
+tool_seconds = metrics.histogram(
+    "chat_tool_seconds", "Tool execution time", label="tool")
+tokens_total = metrics.counter(
+    "chat_tokens_total", "Tokens reported by the model's usage chunk", label="kind")
+client_disconnects_total = metrics.counter(
+    "chat_client_disconnects_total", "Responses abandoned by the client before they finished")
+
+
+async def observe_stream(body: AsyncIterator[bytes], started: float) -> AsyncIterator[bytes]:
+    """Record time to first frame and the gaps between frames of a response."""
+    last = None
+
+    async for frame in body:
+        now = time.perf_counter()
+
+        if last is None:
+            first_frame_seconds.observe(now - started)
+        else:
+            inter_frame_seconds.observe(now - last)
+
+        last = now
+        yield frame
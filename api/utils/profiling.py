@@ -0,0 +1,167 @@
+"""
+Opt-in sampling profiler for a single chat stream.
+
+The event loop's stack is sampled every PROFILE_INTERVAL_MS of CPU time,
+keeping only samples taken while one of the stream's own tasks is running,
+so concurrent requests don't pollute the profile. Sampling uses SIGPROF,
+so it needs the event loop on the main thread, as under uvicorn. Samples
+are written in the folded-stack format read by flamegraph.pl, speedscope
+and inferno.
+
+Enable for every stream with PROFILE_STREAMS=1, or per request by sending
+`x-profile: <PROFILE_TOKEN>` when PROFILE_TOKEN is set.
+"""
+import os
+import hmac
+import time
+import signal
+import asyncio
+import threading
+import contextvars
+from collections import Counter
+from typing import AsyncIterator, Optional, Set
+
+
+PROFILE_STREAMS = os.environ.get("PROFILE_STREAMS", "") not in ("", "0", "false")
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", "")
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "/tmp/profiles")
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", "5"))
+
+_active_profile: contextvars.ContextVar[Optional["StreamProfile"]] = contextvars.ContextVar(
+    "active_profile", default=None)
+
+
+class StreamProfile:
+    def __init__(self, path: str):
+        self.path = path
+        self.tasks: Set[asyncio.Task] = set()
+        self.samples: Counter = Counter()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def write(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        with open(self.path, "w") as file:
+            for stack, count in self.samples.most_common():
+                file.write(f"{stack} {count}\n")
+
+
+def _label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _folded_stack(frame) -> str:
+    labels = []
+
+    while frame is not None:
+        labels.append(_label(frame.f_code))
+        frame = frame.f_back
+
+    return ";".join(reversed(labels))
+
+
+class _Sampler:
+    """
+    Samples on SIGPROF, which fires per PROFILE_INTERVAL_MS of CPU time and
+    interrupts the main thread between bytecodes. Samples are therefore
+    proportional to CPU use, unlike a sampling thread, which can only take
+    the GIL when the event loop gives it up and so mostly sees it idle.
+    """
+
+    def __init__(self):
+        self._profiles: Set[StreamProfile] = set()
+        self._previous_handler = None
+
+    @staticmethod
+    def available() -> bool:
+        return hasattr(signal, "SIGPROF") and threading.current_thread() is threading.main_thread()
+
+    def add(self, profile: StreamProfile):
+        if not self._profiles:
+            interval = PROFILE_INTERVAL_MS / 1000
+            self._previous_handler = signal.signal(signal.SIGPROF, self._sample)
+            signal.setitimer(signal.ITIMER_PROF, interval, interval)
+
+        self._profiles.add(profile)
+
+    def remove(self, profile: StreamProfile):
+        self._profiles.discard(profile)
+
+        if not self._profiles:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, self._previous_handler or signal.SIG_DFL)
+
+    def _sample(self, signum, frame):
+        for profile in self._profiles:
+            task = asyncio.tasks._current_tasks.get(profile.loop)
+            if task is not None and task in profile.tasks:
+                profile.samples[_folded_stack(frame)] += 1
+
+
+_sampler = _Sampler()
+_factories_installed: Set[int] = set()
+
+
+def _install_task_factory(loop: asyncio.AbstractEventLoop):
+    # Tasks created while a profiled stream is running (such as the
+    # coalescer's upstream reader) belong to that stream's profile.
+    if id(loop) in _factories_installed:
+        return
+
+    previous = loop.get_task_factory()
+
+    def factory(loop, coro, **kwargs):
+        if previous is not None:
+            task = previous(loop, coro, **kwargs)
+        else:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+
+        profile = _active_profile.get()
+        if profile is not None:
+            profile.tasks.add(task)
+
+        return task
+
+    loop.set_task_factory(factory)
+    _factories_installed.add(id(loop))
+
+
+def should_profile(header: Optional[str]) -> bool:
+    if PROFILE_STREAMS:
+        return True
+    return bool(PROFILE_TOKEN) and header is not None and hmac.compare_digest(
+        header.encode(), PROFILE_TOKEN.encode())
+
+
+def new_profile() -> StreamProfile:
+    name = f"chat-{time.strftime('%Y%m%d-%H%M%S')}-{os.urandom(4).hex()}.folded"
+    return StreamProfile(os.path.join(PROFILE_DIR, name))
+
+
+async def profile_stream(body: AsyncIterator[bytes], profile: StreamProfile) -> AsyncIterator[bytes]:
+    if not _sampler.available():
+        print("Stream profiling needs the event loop on the main thread")
+        async for frame in body:
+            yield frame
+        return
+
+    loop = asyncio.get_running_loop()
+    _install_task_factory(loop)
+
+    profile.loop = loop
+    profile.tasks.add(asyncio.current_task())
+    token = _active_profile.set(profile)
+    _sampler.add(profile)
+
+    try:
+        async for frame in body:
+            yield frame
+
+    finally:
+        _sampler.remove(profile)
+        try:
+            _active_profile.reset(token)
+        except ValueError:
+            pass
+
+        await asyncio.to_thread(profile.write)
@@ -1,10 +1,18 @@
+import os
 import json
+import hashlib
+from collections import OrderedDict
 from enum import Enum
-from openai.types.chat.chat_completion_message_param import ChatCompletionMessageParam
 from pydantic import BaseModel
 import base64
-from typing import List, Optional, Any
+from typing import TYPE_CHECKING, List, Optional, Any
 from .attachment import ClientAttachment
+from .registry import ToolRegistry
+from .budget import compact_messages
+from .data_stream import dumps
+
+if TYPE_CHECKING:
+    from openai.types.chat.chat_completion_message_param import ChatCompletionMessageParam
 
 class ToolInvocationState(str, Enum):
     CALL = 'call'
@@ -25,61 +33,112 @@ class ClientMessage(BaseModel):
     experimental_attachments: Optional[List[ClientAttachment]] = None
     toolInvocations: Optional[List[ToolInvocation]] = None
 
-def convert_to_openai_messages(messages: List[ClientMessage]) -> List[ChatCompletionMessageParam]:
-    openai_messages = []
 
-    for message in messages:
-        parts = []
-        tool_calls = []
-
-        parts.append({
-            'type': 'text',
-            'text': message.content
-        })
-
-        if (message.experimental_attachments):
-            for attachment in message.experimental_attachments:
-                if (attachment.contentType.startswith('image')):
-                    parts.append({
-                        'type': 'image_url',
-                        'image_url': {
-                            'url': attachment.url
-                        }
-                    })
-
-                elif (attachment.contentType.startswith('text')):
-                    parts.append({
-                        'type': 'text',
-                        'text': attachment.url
-                    })
-
-        if(message.toolInvocations):
-            for toolInvocation in message.toolInvocations:
-                tool_calls.append({
-                    "id": toolInvocation.toolCallId,
-                    "type": "function",
-                    "function": {
-                        "name": toolInvocation.toolName,
-                        "arguments": json.dumps(toolInvocation.args)
+# Opt-in. Only messages with tool invocations are cached: converting them
+# runs each result through the tool's model view, and every turn re-sends
+# the whole history. Anything else converts faster than it could be keyed.
+CONVERSION_CACHE_SIZE = int(os.environ.get("CONVERSION_CACHE_SIZE", "0"))
+
+# Converted messages keyed by a digest of the invocations. Call ids come from
+# the client and replayed responses reuse them, so the args and results are
+# part of the key too.
+_conversion_cache: "OrderedDict[tuple, List[dict]]" = OrderedDict()
+
+
+def convert_message(message: ClientMessage, tools: Optional[ToolRegistry] = None) -> List[dict]:
+    parts = []
+    tool_calls = []
+    converted = []
+
+    parts.append({
+        'type': 'text',
+        'text': message.content
+    })
+
+    if (message.experimental_attachments):
+        for attachment in message.experimental_attachments:
+            if (attachment.contentType.startswith('image')):
+                parts.append({
+                    'type': 'image_url',
+                    'image_url': {
+                        'url': attachment.url
                     }
                 })
 
-        tool_calls_dict = {"tool_calls": tool_calls} if tool_calls else {"tool_calls": None}
-
-        openai_messages.append({
-            "role": message.role,
-            "content": parts,
-            **tool_calls_dict,
-        })
+            elif (attachment.contentType.startswith('text')):
+                parts.append({
+                    'type': 'text',
+                    'text': attachment.url
+                })
 
-        if(message.toolInvocations):
-            for toolInvocation in message.toolInvocations:
-                tool_message = {
-                    "role": "tool",
-                    "tool_call_id": toolInvocation.toolCallId,
-                    "content": json.dumps(toolInvocation.result),
+    if(message.toolInvocations):
+        for toolInvocation in message.toolInvocations:
+            tool_calls.append({
+                "id": toolInvocation.toolCallId,
+                "type": "function",
+                "function": {
+                    "name": toolInvocation.toolName,
+                    "arguments": json.dumps(toolInvocation.args)
                 }
+            })
+
+    tool_calls_dict = {"tool_calls": tool_calls} if tool_calls else {"tool_calls": None}
+
+    converted.append({
+        "role": message.role,
+        "content": parts,
+        **tool_calls_dict,
+    })
+
+    if(message.toolInvocations):
+        for toolInvocation in message.toolInvocations:
+            result = toolInvocation.result
+            if tools is not None:
+                result = tools.model_view(toolInvocation.toolName, result)
+
+            tool_message = {
+                "role": "tool",
+                "tool_call_id": toolInvocation.toolCallId,
+                "content": json.dumps(result),
+            }
+
+            converted.append(tool_message)
+
+    return converted
+
+
+def _invocations_digest(invocations: List[ToolInvocation]) -> bytes:
+    return hashlib.blake2b(dumps([
+        [invocation.toolCallId, invocation.toolName, invocation.state, invocation.args, invocation.result]
+        for invocation in invocations
+    ]), digest_size=16).digest()
+
+
+def convert_to_openai_messages(
+    messages: List[ClientMessage],
+    tools: Optional[ToolRegistry] = None,
+    token_budget: Optional[int] = None,
+) -> List["ChatCompletionMessageParam"]:
+    openai_messages = []
+
+    for message in messages:
+        if CONVERSION_CACHE_SIZE <= 0 or not message.toolInvocations or message.experimental_attachments:
+            openai_messages.extend(convert_message(message, tools))
+            continue
+
+        key = (id(tools), message.role, message.content, _invocations_digest(message.toolInvocations))
+        converted = _conversion_cache.get(key)
+
+        if converted is None:
+            converted = convert_message(message, tools)
+            _conversion_cache[key] = converted
+
+            if len(_conversion_cache) > CONVERSION_CACHE_SIZE:
+                _conversion_cache.popitem(last=False)
+        else:
+            _conversion_cache.move_to_end(key)
 
-                openai_messages.append(tool_message)
+        # Shallow copies, so a caller can't change the cached messages.
+        openai_messages.extend(dict(converted_message) for converted_message in converted)
 
-    return openai_messages
+    return compact_messages(openai_messages, token_budget)
@@ -0,0 +1,154 @@
+"""
+Tokens-per-minute quotas, per client and for the whole deployment.
+
+Before calling the model, a request reserves its estimated prompt tokens
+plus QUOTA_COMPLETION_RESERVE for the answer. Once the usage chunk arrives
+the reservation is settled to the real total, so the windows track what
+OpenAI actually counts. QUOTA_GLOBAL_TPM should be set a little under the
+organization's TPM limit, so that requests are turned away here instead of
+being throttled by OpenAI mid-stream. A limit of 0 disables that window.
+Like the admission bucket, the per-client window defaults to off unless
+client addresses can be trusted.
+"""
+import os
+import time
+import functools
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional
+
+from .admission import ADMISSION_TRUST_FORWARDED
+from .budget import count_tokens
+
+
+QUOTA_USER_TPM = int(os.environ.get(
+    "QUOTA_USER_TPM", "100000" if ADMISSION_TRUST_FORWARDED else "0"))
+QUOTA_GLOBAL_TPM = int(os.environ.get("QUOTA_GLOBAL_TPM", "0"))
+QUOTA_COMPLETION_RESERVE = int(os.environ.get("QUOTA_COMPLETION_RESERVE", "1024"))
+QUOTA_MAX_USERS = int(os.environ.get("QUOTA_MAX_USERS", "10000"))
+
+WINDOW = 60.0
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__("token quota exceeded")
+        self.retry_after = retry_after
+
+
+class SlidingWindow:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.total = 0
+        # [timestamp, tokens] pairs, oldest first. Lists, so a reservation
+        # can be settled in place.
+        self._entries: "deque[List[float]]" = deque()
+
+    def _expire(self, now: float):
+        while self._entries and self._entries[0][0] <= now - WINDOW:
+            self.total -= self._entries.popleft()[1]
+
+    def wait(self, tokens: int, now: float) -> float:
+        """Seconds until `tokens` fit in the window; 0 if they fit now."""
+        self._expire(now)
+
+        # A request bigger than the whole limit still runs on its own.
+        if self.total + tokens <= self.limit or not self._entries:
+            return 0.0
+
+        excess = self.total + tokens - self.limit
+        for timestamp, used in self._entries:
+            excess -= used
+            if excess <= 0:
+                return timestamp + WINDOW - now
+
+        return WINDOW
+
+    def add(self, tokens: int, now: float) -> List[float]:
+        entry = [now, tokens]
+        self._entries.append(entry)
+        self.total += tokens
+        return entry
+
+    def adjust(self, entry: List[float], tokens: int):
+        # An entry that has already expired no longer counts.
+        if self._entries and entry[0] >= self._entries[0][0]:
+            self.total += tokens - entry[1]
+        entry[1] = tokens
+
+
+class Reservation:
+    def __init__(self, tokens: int, entries: List):
+        self.tokens = tokens
+        self.settled = False
+        self._entries = entries
+
+    def settle(self, tokens: int):
+        """Replace the estimate with the real usage. Only the first call counts."""
+        if self.settled:
+            return
+
+        self.settled = True
+        self.tokens = tokens
+        for window, entry in self._entries:
+            window.adjust(entry, tokens)
+
+
+class TokenQuota:
+    def __init__(self, user_tpm: int = QUOTA_USER_TPM, global_tpm: int = QUOTA_GLOBAL_TPM, max_users: int = QUOTA_MAX_USERS):
+        self.user_tpm = user_tpm
+        self.global_window = SlidingWindow(global_tpm) if global_tpm > 0 else None
+        self.max_users = max_users
+        self._users: "OrderedDict[str, SlidingWindow]" = OrderedDict()
+        self._counts = {"reserved_tokens": 0, "rejected": 0}
+
+    def _user(self, user: str) -> Optional[SlidingWindow]:
+        if self.user_tpm <= 0:
+            return None
+
+        window = self._users.get(user)
+
+        if window is None:
+            window = self._users[user] = SlidingWindow(self.user_tpm)
+            if len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user)
+
+        return window
+
+    def reserve(self, user: str, tokens: int) -> Reservation:
+        """Reserve `tokens` for `user`, or raise `QuotaExceeded`."""
+        now = time.monotonic()
+        windows = [w for w in (self._user(user), self.global_window) if w is not None]
+
+        wait = max([window.wait(tokens, now) for window in windows], default=0.0)
+        if wait > 0:
+            self._counts["rejected"] += 1
+            raise QuotaExceeded(wait)
+
+        self._counts["reserved_tokens"] += tokens
+        return Reservation(tokens, [(window, window.add(tokens, now)) for window in windows])
+
+    # The stats that only ever go up.
+    counter_stats = ("reserved_tokens", "rejected")
+
+    def stats(self) -> Dict[str, float]:
+        now = time.monotonic()
+        if self.global_window is not None:
+            self.global_window._expire(now)
+
+        return {
+            "users": len(self._users),
+            "global_tokens": self.global_window.total if self.global_window is not None else 0,
+            **self._counts,
+        }
+
+
+@functools.lru_cache(maxsize=4)
+def _schema_tokens(tools_json: str) -> int:
+    return count_tokens(tools_json) if tools_json else 0
+
+
+def estimate_tokens(prompt_tokens: int, tools_json: str = "") -> int:
+    """The prompt's tokens plus the tool schemas' and the completion reserve."""
+    return prompt_tokens + _schema_tokens(tools_json) + QUOTA_COMPLETION_RESERVE
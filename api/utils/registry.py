@@ -0,0 +1,124 @@
+import json
+import inspect
+from typing import Any, Callable, Dict, Iterator, List, Optional, Type, get_type_hints
+
+from pydantic import BaseModel, Field, create_model
+
+
+def _strip_titles(schema: Any) -> Any:
+    # Pydantic adds a "title" to every model and property; the model never
+    # needs them and they cost prompt tokens on every request.
+    if isinstance(schema, dict):
+        return {
+            key: _strip_titles(value) for key, value in schema.items()
+            if not (key == "title" and isinstance(value, str))
+        }
+    if isinstance(schema, list):
+        return [_strip_titles(value) for value in schema]
+    return schema
+
+
+class ToolRegistry:
+    """
+    Tools available to the model, keyed by name. Each tool's JSON schema is
+    derived once at registration from its signature (or an explicit Pydantic
+    model), so requests reuse the same schema list instead of building it.
+
+    A tool may also register two projections of its result: `project` trims
+    the result sent to the client, and `model_view` is a compact encoding
+    used when the result is sent back to the model in a later turn.
+    """
+
+    def __init__(self):
+        self._functions: Dict[str, Callable] = {}
+        self._schemas: Dict[str, dict] = {}
+        self._projections: Dict[str, Callable] = {}
+        self._model_views: Dict[str, Callable] = {}
+        self._schema_list: Optional[List[dict]] = None
+        self._schema_json: Optional[str] = None
+
+    def tool(
+        self,
+        description: str,
+        parameters: Optional[Type[BaseModel]] = None,
+        project: Optional[Callable] = None,
+        model_view: Optional[Callable] = None,
+        **parameter_descriptions: str,
+    ):
+        def decorator(function: Callable):
+            model = parameters or self._model_from_signature(
+                function, parameter_descriptions)
+
+            self.register(function.__name__, function, {
+                "type": "function",
+                "function": {
+                    "name": function.__name__,
+                    "description": description,
+                    "parameters": _strip_titles(model.model_json_schema()),
+                },
+            })
+
+            if project is not None:
+                self._projections[function.__name__] = project
+            if model_view is not None:
+                self._model_views[function.__name__] = model_view
+
+            return function
+
+        return decorator
+
+    def register(self, name: str, function: Callable, schema: dict):
+        self._functions[name] = function
+        self._schemas[name] = schema
+        self._schema_list = None
+        self._schema_json = None
+
+    @property
+    def schemas(self) -> List[dict]:
+        if self._schema_list is None:
+            self._schema_list = list(self._schemas.values())
+        return self._schema_list
+
+    @property
+    def schemas_json(self) -> str:
+        if self._schema_json is None:
+            self._schema_json = json.dumps(self.schemas, sort_keys=True)
+        return self._schema_json
+
+    def project(self, name: str, result: Any) -> Any:
+        projection = self._projections.get(name)
+        if projection is None or result is None:
+            return result
+        return projection(result)
+
+    def model_view(self, name: str, result: Any) -> Any:
+        view = self._model_views.get(name)
+        if view is None or result is None:
+            return result
+        return view(result)
+
+    def __getitem__(self, name: str) -> Callable:
+        return self._functions[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._functions
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._functions)
+
+    def __len__(self) -> int:
+        return len(self._functions)
+
+    @staticmethod
+    def _model_from_signature(function: Callable, descriptions: Dict[str, str]) -> Type[BaseModel]:
+        hints = get_type_hints(function)
+        fields = {}
+
+        for name, parameter in inspect.signature(function).parameters.items():
+            default = ... if parameter.default is inspect.Parameter.empty else parameter.default
+            fields[name] = (
+                hints.get(name, Any),
+                Field(default, description=descriptions.get(name)),
+            )
+
+        return create_model(function.__name__, **fields)
@@ -0,0 +1,252 @@
+import os
+import time
+import asyncio
+import hashlib
+from typing import Any, AsyncIterator, Callable, List, Optional, Set, Tuple
+
+from .cache import TTLCache
+from .data_stream import dumps
+
+
+# Opt-in: identical conversations replay a recorded model response instead
+# of calling the model again.
+RESPONSE_CACHE = os.environ.get("RESPONSE_CACHE", "") not in ("", "0", "false")
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "2048"))
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Replays keep the recorded gap between chunks, capped at this many ms.
+RESPONSE_CACHE_MAX_GAP_MS = float(os.environ.get("RESPONSE_CACHE_MAX_GAP_MS", "30"))
+# Cosine similarity above which a different first prompt counts as the
+# same question. 0 disables the semantic tier.
+RESPONSE_CACHE_SIMILARITY = float(os.environ.get("RESPONSE_CACHE_SIMILARITY", "0"))
+
+# Rough per-chunk overhead when sizing a recording against the byte cap.
+_CHUNK_BYTES = 256
+
+
+def _normalize_text(text: str) -> str:
+    return " ".join(text.split()).lower()
+
+
+def _normalize(messages: List[dict]) -> List[Any]:
+    normalized = []
+
+    for message in messages:
+        content = message.get("content")
+
+        if isinstance(content, str):
+            content = _normalize_text(content)
+        elif content:
+            content = [
+                _normalize_text(part["text"]) if part.get("type") == "text" else part
+                for part in content
+            ]
+
+        normalized.append([
+            message.get("role"),
+            content,
+            message.get("tool_calls") or None,
+            message.get("tool_call_id"),
+        ])
+
+    return normalized
+
+
+def response_key(model: str, messages: List[dict], tools_json: str) -> str:
+    """Hash of the model, normalized conversation and offered tool schemas."""
+    payload = dumps([model, tools_json, _normalize(messages)])
+    return hashlib.sha256(payload).hexdigest()
+
+
+def _first_prompt(messages: List[dict]) -> Optional[str]:
+    # The semantic tier only covers conversations made of one user message,
+    # where near-duplicate questions are common and safe to match.
+    if len(messages) != 1 or messages[0].get("role") != "user":
+        return None
+
+    content = messages[0].get("content")
+    if isinstance(content, str):
+        return content
+
+    texts = [part["text"] for part in content or () if part.get("type") == "text"]
+    if len(texts) != len(content or ()):
+        return None
+
+    return " ".join(texts)
+
+
+def _load_embedder() -> Optional[Callable[[str], List[float]]]:
+    try:
+        from fastembed import TextEmbedding
+        model = TextEmbedding()
+        return lambda text: list(next(iter(model.embed([text]))))
+    except Exception:
+        pass
+
+    try:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer("all-MiniLM-L6-v2")
+        return lambda text: model.encode(text, normalize_embeddings=True).tolist()
+    except Exception:
+        return None
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = (sum(x * x for x in a) * sum(y * y for y in b)) ** 0.5
+    return dot / norm if norm else 0.0
+
+
+def _calls_tools(recording: List[Tuple[float, Any]]) -> bool:
+    return any(choice.delta.tool_calls for _, chunk in recording for choice in chunk.choices)
+
+
+class ResponseCache:
+    """
+    Recorded upstream chunk sequences keyed by `response_key`.
+
+    What is cached is the model's output, not the encoded frames: on replay
+    tool calls are executed again, so tool results are never stale.
+    """
+
+    def __init__(
+        self,
+        ttl: float = RESPONSE_CACHE_TTL,
+        max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+        max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+        similarity: float = RESPONSE_CACHE_SIMILARITY,
+    ):
+        self.recordings = TTLCache(
+            ttl=ttl, max_entries=max_entries, max_bytes=max_bytes)
+        self.similarity = similarity
+        self.semantic_hits = 0
+
+        self._embed: Optional[Callable[[str], List[float]]] = None
+        self._embedder_loaded = False
+        self._loading: Optional[asyncio.Task] = None
+        self._prompts: List[Tuple[List[float], str]] = []
+        # Background embeddings, referenced until they finish.
+        self._indexing: Set[asyncio.Task] = set()
+
+    def _load_embedder(self) -> asyncio.Task:
+        # Loading may download the model and take seconds, so it runs in the
+        # background; lookups skip the semantic tier until it's done.
+        if self._loading is None:
+            self._loading = asyncio.create_task(asyncio.to_thread(_load_embedder))
+            self._loading.add_done_callback(self._embedder_ready)
+        return self._loading
+
+    def _embedder_ready(self, task: asyncio.Task):
+        if task.cancelled():
+            self._loading = None
+            return
+
+        self._embed = task.result()
+        self._embedder_loaded = True
+
+    async def _embedding(self, text: str) -> Optional[List[float]]:
+        if self._embed is None:
+            return None
+
+        return await asyncio.to_thread(self._embed, text)
+
+    async def get(self, key: str, messages: List[dict]) -> Optional[List[Tuple[float, Any]]]:
+        entry = self.recordings.get(key)
+        if entry is not None:
+            return entry[0]
+
+        prompt = _first_prompt(messages) if self.similarity > 0 else None
+        if prompt is None:
+            return None
+
+        if not self._embedder_loaded:
+            self._load_embedder()
+            return None
+
+        embedding = await self._embedding(_normalize_text(prompt))
+        if embedding is None:
+            return None
+
+        best_key, best_score = None, self.similarity
+        for candidate, candidate_key in self._prompts:
+            score = _cosine(embedding, candidate)
+            if score >= best_score:
+                best_key, best_score = candidate_key, score
+
+        if best_key is None:
+            return None
+
+        entry = self.recordings.get(best_key)
+        if entry is None:
+            return None
+
+        self.semantic_hits += 1
+        return entry[0]
+
+    def _store(self, key: str, recording: List[Tuple[float, Any]]):
+        size = sum(
+            _CHUNK_BYTES + sum(len(choice.delta.content or "") for choice in chunk.choices)
+            for _, chunk in recording)
+        self.recordings.set(key, recording, size)
+
+    async def _index_prompt(self, key: str, messages: List[dict]):
+        prompt = _first_prompt(messages) if self.similarity > 0 else None
+        if prompt is None:
+            return
+
+        if not self._embedder_loaded:
+            await asyncio.shield(self._load_embedder())
+
+        embedding = await self._embedding(_normalize_text(prompt))
+        if embedding is None:
+            return
+
+        # Drop prompts whose recording has been evicted.
+        self._prompts = [
+            (vector, prompt_key) for vector, prompt_key in self._prompts
+            if prompt_key in self.recordings
+        ]
+        self._prompts.append((embedding, key))
+
+    async def record(self, key: str, messages: List[dict], stream: AsyncIterator) -> AsyncIterator:
+        """Pass an upstream stream through, caching it once it completes."""
+        recording = []
+        last = time.monotonic()
+
+        try:
+            async for chunk in stream:
+                now = time.monotonic()
+                recording.append((now - last, chunk))
+                last = now
+                yield chunk
+        finally:
+            await stream.close()
+
+        self._store(key, recording)
+
+        # A similar question may need different tool arguments ("weather in
+        # London" is not "weather in Paris"), so only plain answers are
+        # matched semantically. Embedding the prompt may first load the
+        # model, which can take seconds; the response must not stay open
+        # for that.
+        if self.similarity > 0 and not _calls_tools(recording):
+            task = asyncio.create_task(self._index_prompt(key, messages))
+            self._indexing.add(task)
+            task.add_done_callback(self._indexed)
+
+    def _indexed(self, task: asyncio.Task):
+        self._indexing.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Error indexing cached response: {task.exception()!r}")
+
+    @staticmethod
+    async def replay(recording: List[Tuple[float, Any]], max_gap: float = RESPONSE_CACHE_MAX_GAP_MS / 1000) -> AsyncIterator:
+        for gap, chunk in recording:
+            if gap > 0 and max_gap > 0:
+                await asyncio.sleep(min(gap, max_gap))
+            yield chunk
+
+    counter_stats = TTLCache.counter_stats + ("semantic_hits",)
+
+    def stats(self):
+        return {**self.recordings.stats(), "semantic_hits": self.semantic_hits}
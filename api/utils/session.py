@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import tempfile
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import List, Optional
+
+
+# "memory" or "disk" to keep converted conversations on the server, so a
+# client can send only its new message along with the chat id.
+SESSION_STORE = os.environ.get("SESSION_STORE", "")
+SESSION_DIR = os.environ.get("SESSION_DIR", "/tmp/chat-sessions")
+SESSION_MAX_CHATS = int(os.environ.get("SESSION_MAX_CHATS", "1000"))
+SESSION_TTL = float(os.environ.get("SESSION_TTL", "86400"))
+
+
+def session_key(client: str, chat_id: str) -> str:
+    # Chat ids come from the client and can be guessed, so a session only
+    # belongs to the client that started it.
+    return f"{client}\n{chat_id}"
+
+
+class SessionStore(ABC):
+    """Converted OpenAI messages of each conversation, keyed by `session_key`."""
+
+    @abstractmethod
+    async def load(self, chat_id: str) -> Optional[List[dict]]:
+        ...
+
+    @abstractmethod
+    async def save(self, chat_id: str, messages: List[dict]):
+        ...
+
+
+class MemorySessionStore(SessionStore):
+    def __init__(self, max_chats: int = SESSION_MAX_CHATS, ttl: float = SESSION_TTL):
+        self.max_chats = max_chats
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, tuple]" = OrderedDict()
+
+    async def load(self, chat_id: str) -> Optional[List[dict]]:
+        session = self._sessions.get(chat_id)
+        if session is None:
+            return None
+
+        messages, saved_at = session
+        if time.monotonic() - saved_at > self.ttl:
+            del self._sessions[chat_id]
+            return None
+
+        self._sessions.move_to_end(chat_id)
+        return list(messages)
+
+    async def save(self, chat_id: str, messages: List[dict]):
+        self._sessions[chat_id] = (list(messages), time.monotonic())
+        self._sessions.move_to_end(chat_id)
+
+        while len(self._sessions) > self.max_chats:
+            self._sessions.popitem(last=False)
+
+
+class DiskSessionStore(SessionStore):
+    """One JSON file per chat, for sessions that must survive a restart."""
+
+    def __init__(self, directory: str = SESSION_DIR, ttl: float = SESSION_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, chat_id: str) -> str:
+        # Keys come from the client, so never use them as file names.
+        name = hashlib.sha256(chat_id.encode()).hexdigest()
+        return os.path.join(self.directory, f"{name}.json")
+
+    def _read(self, chat_id: str) -> Optional[List[dict]]:
+        path = self._path(chat_id)
+
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+
+            with open(path) as file:
+                return json.load(file)
+
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, chat_id: str, messages: List[dict]):
+        path = self._path(chat_id)
+        descriptor, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+
+        try:
+            with os.fdopen(descriptor, "w") as file:
+                json.dump(messages, file)
+
+            os.replace(temporary, path)
+        except BaseException:
+            os.remove(temporary)
+            raise
+
+    async def load(self, chat_id: str) -> Optional[List[dict]]:
+        return await asyncio.to_thread(self._read, chat_id)
+
+    async def save(self, chat_id: str, messages: List[dict]):
+        await asyncio.to_thread(self._write, chat_id, messages)
+
+
+def create_session_store(kind: str = SESSION_STORE) -> Optional[SessionStore]:
+    if kind == "memory":
+        return MemorySessionStore()
+    if kind == "disk":
+        return DiskSessionStore()
+    return None
@@ -0,0 +1,44 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key: the first caller runs the
+    call, and everyone arriving while it is in flight awaits the same future.
+    The call is cancelled once every caller waiting on it has been.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self._waiters: Dict[asyncio.Future, int] = {}
+        self.shared = 0
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._calls.get(key)
+
+        if future is not None:
+            self.shared += 1
+        else:
+            future = asyncio.ensure_future(call())
+            self._calls[key] = future
+            future.add_done_callback(lambda done: self._forget(key, done))
+
+        self._waiters[future] = self._waiters.get(future, 0) + 1
+
+        try:
+            # Shield so one waiter being cancelled doesn't cancel the call
+            # for everybody else.
+            return await asyncio.shield(future)
+        finally:
+            self._waiters[future] -= 1
+            if not self._waiters[future]:
+                del self._waiters[future]
+                if not future.done():
+                    self._forget(key, future)
+                    future.cancel()
+
+    def _forget(self, key: Hashable, future: asyncio.Future):
+        # A newer call may already be in flight under the same key.
+        if self._calls.get(key) is future:
+            del self._calls[key]
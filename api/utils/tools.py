@@ -1,12 +1,126 @@
-import requests
+import os
+from datetime import datetime
+from .cache import TTLCache, cached, geohash
+from .http import get_http_client
+from .registry import ToolRegistry
 
-def get_current_weather(latitude, longitude):
-    # Format the URL with proper parameter substitution
-    url = f"https://api.open-meteo.com/v1/forecast?latitude={latitude}&longitude={longitude}&current=temperature_2m&hourly=temperature_2m&daily=sunrise,sunset&timezone=auto"
+
+tools = ToolRegistry()
+
+WEATHER_CACHE_PRECISION = int(os.environ.get("WEATHER_CACHE_PRECISION", "5"))
+
+weather_cache = TTLCache(
+    ttl=float(os.environ.get("WEATHER_CACHE_TTL", "600")),
+    stale_ttl=float(os.environ.get("WEATHER_CACHE_STALE_TTL", "1800")),
+    max_entries=int(os.environ.get("WEATHER_CACHE_MAX_ENTRIES", "1024")),
+    max_bytes=int(os.environ.get("WEATHER_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+)
+
+
+# The weather widget shows today's high and low (the first 24 hours) and the
+# six hours from now, so later hours are never looked at.
+WEATHER_HOURS = 30
+
+
+def project_weather(result):
+    hourly = result.get("hourly", {})
+    daily = result.get("daily", {})
+
+    return {
+        "latitude": result.get("latitude"),
+        "longitude": result.get("longitude"),
+        "timezone": result.get("timezone"),
+        "current_units": {
+            "temperature_2m": result.get("current_units", {}).get("temperature_2m"),
+        },
+        "current": {
+            "time": result.get("current", {}).get("time"),
+            "temperature_2m": result.get("current", {}).get("temperature_2m"),
+        },
+        "hourly_units": {
+            "temperature_2m": result.get("hourly_units", {}).get("temperature_2m"),
+        },
+        "hourly": {
+            "time": hourly.get("time", [])[:WEATHER_HOURS],
+            "temperature_2m": hourly.get("temperature_2m", [])[:WEATHER_HOURS],
+        },
+        "daily": {
+            "sunrise": daily.get("sunrise", [])[:1],
+            "sunset": daily.get("sunset", [])[:1],
+        },
+    }
+
+
+def _time_step_minutes(times):
+    # Minutes between samples, or None when the series isn't evenly spaced.
+    try:
+        parsed = [datetime.fromisoformat(time) for time in times]
+    except (TypeError, ValueError):
+        return None
+
+    if len(parsed) < 2:
+        return None
+
+    step = parsed[1] - parsed[0]
+    if any(b - a != step for a, b in zip(parsed, parsed[1:])):
+        return None
+
+    return int(step.total_seconds() // 60)
+
+
+def weather_model_view(result):
+    """
+    Compact encoding of a weather result for the model: the hourly series is
+    sent as a start time and step instead of one timestamp per sample.
+    """
+    result = project_weather(result)
+    hourly = result["hourly"]
+    step = _time_step_minutes(hourly["time"])
+
+    if step is None:
+        series = hourly
+    else:
+        series = {
+            "start": hourly["time"][0],
+            "step_minutes": step,
+            "temperature_2m": hourly["temperature_2m"],
+        }
+
+    return {
+        "location": [result["latitude"], result["longitude"], result["timezone"]],
+        "unit": result["current_units"]["temperature_2m"],
+        "current": result["current"],
+        "hourly": series,
+        "sunrise": (result["daily"]["sunrise"] or [None])[0],
+        "sunset": (result["daily"]["sunset"] or [None])[0],
+    }
+
+
+@tools.tool(
+    description="Get the current weather at a location",
+    project=project_weather,
+    model_view=weather_model_view,
+    latitude="The latitude of the location",
+    longitude="The longitude of the location",
+)
+@cached(weather_cache, key=lambda latitude, longitude: geohash(
+    float(latitude), float(longitude), WEATHER_CACHE_PRECISION))
+async def get_current_weather(latitude: float, longitude: float):
+    import httpx
+
+    params = {
+        "latitude": latitude,
+        "longitude": longitude,
+        "current": "temperature_2m",
+        "hourly": "temperature_2m",
+        "daily": "sunrise,sunset",
+        "timezone": "auto",
+    }
 
     try:
-        # Make the API call
-        response = requests.get(url)
+        # Make the API call over the shared connection pool
+        response = await get_http_client().get(
+            "https://api.open-meteo.com/v1/forecast", params=params)
 
         # Raise an exception for bad status codes
         response.raise_for_status()
@@ -14,7 +128,7 @@ def get_current_weather(latitude, longitude):
         # Return the JSON response
         return response.json()
 
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         # Handle any errors that occur during the request
         print(f"Error fetching weather data: {e}")
         return None
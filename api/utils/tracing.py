@@ -0,0 +1,242 @@
+"""
+Optional request tracing with OpenTelemetry-compatible spans.
+
+Set TRACE_EXPORT to a file path to append one OTLP JSON span per line, or
+to an OTLP/HTTP collector URL (e.g. http://localhost:4318/v1/traces) to
+post spans in batches. When it is unset `span()` returns a shared no-op
+object, so disabled tracing costs one global lookup per call site.
+"""
+import os
+import json
+import time
+import asyncio
+import contextvars
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from .http import get_http_client
+
+
+TRACE_EXPORT = os.environ.get("TRACE_EXPORT", "")
+TRACE_SERVICE_NAME = os.environ.get("TRACE_SERVICE_NAME", "chat-api")
+TRACE_BATCH_SIZE = int(os.environ.get("TRACE_BATCH_SIZE", "64"))
+
+_current: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar(
+    "current_span", default=None)
+
+
+def _attribute(key: str, value: Any) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start",
+                 "attributes", "error", "_token")
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.start = time.time_ns()
+        self.attributes = attributes
+        self.error: Optional[str] = None
+        self._token = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def attach(self):
+        """Make this the current span in this context, until `detach`."""
+        self._token = _current.set(self)
+
+    def detach(self):
+        if self._token is None:
+            return
+
+        token, self._token = self._token, None
+        try:
+            _current.reset(token)
+        except ValueError:
+            # Detached from another context, e.g. an async generator closed
+            # by a different task than the one that started it.
+            pass
+
+    def end(self):
+        self.detach()
+        exporter.export(self, time.time_ns())
+
+    def __enter__(self):
+        self.attach()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc is not None and not isinstance(exc, (GeneratorExit, asyncio.CancelledError)):
+            self.error = repr(exc)
+
+        self.end()
+        return False
+
+    def to_otlp(self, end: int) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start),
+            "endTimeUnixNano": str(end),
+            "attributes": [_attribute(key, value) for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+
+        return span
+
+
+class _NoopSpan:
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def attach(self):
+        pass
+
+    def detach(self):
+        pass
+
+    def end(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Exporter:
+    def __init__(self, target: str):
+        self.target = target
+        self.enabled = bool(target)
+        self._is_http = target.startswith(("http://", "https://"))
+        self._file = None
+        self._batch: List[dict] = []
+        self._pending = set()
+
+    def export(self, span: Span, end: int):
+        otlp = span.to_otlp(end)
+
+        if not self._is_http:
+            if self._file is None:
+                self._file = open(self.target, "a", buffering=1)
+            self._file.write(json.dumps(otlp) + "\n")
+            return
+
+        self._batch.append(otlp)
+        if len(self._batch) >= TRACE_BATCH_SIZE:
+            task = asyncio.ensure_future(self._post(self._take()))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+
+    def _take(self) -> List[dict]:
+        batch, self._batch = self._batch, []
+        return batch
+
+    async def _post(self, spans: List[dict]):
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": [_attribute("service.name", TRACE_SERVICE_NAME)]},
+            "scopeSpans": [{"scope": {"name": "api.utils.tracing"}, "spans": spans}],
+        }]}
+
+        try:
+            response = await get_http_client().post(self.target, json=payload)
+            response.raise_for_status()
+        except Exception as e:
+            print(f"Error exporting {len(spans)} spans: {e}")
+
+    async def flush(self):
+        if self._is_http and self._batch:
+            await self._post(self._take())
+
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+
+        if self._file is not None:
+            self._file.flush()
+
+
+exporter = Exporter(TRACE_EXPORT)
+
+
+def span(name: str, **attributes: Any):
+    """A span for a `with` block, child of the current span if any."""
+    if not exporter.enabled:
+        return NOOP_SPAN
+
+    return Span(name, _current.get(), attributes)
+
+
+def record_span(name: str, start: int, seconds: float, **attributes: Any):
+    """
+    A child of the current span for work that already happened, starting
+    at `start` (from `time.time_ns()`) and taking `seconds`.
+    """
+    if not exporter.enabled:
+        return
+
+    recorded = Span(name, _current.get(), attributes)
+    recorded.start = start
+    exporter.export(recorded, start + int(seconds * 1e9))
+
+
+def start_span(name: str, start: Optional[int] = None, **attributes: Any):
+    """
+    A span that is current until it is detached or ended, and is ended
+    explicitly, for work that outlives the handler, like a streamed body.
+    `start` backdates it, in `time.time_ns()`.
+    """
+    if not exporter.enabled:
+        return NOOP_SPAN
+
+    current = Span(name, _current.get(), attributes)
+    if start is not None:
+        current.start = start
+    current.attach()
+    return current
+
+
+async def trace_stream(body: AsyncIterator[bytes], root) -> AsyncIterator[bytes]:
+    """
+    Wrap a response body in a span, and end `root` once it is written.
+    The body runs in its own task, so `root` is made current there again.
+    """
+    if root is NOOP_SPAN:
+        async for frame in body:
+            yield frame
+        return
+
+    frames = 0
+    size = 0
+    root.attach()
+
+    try:
+        with span("chat.stream") as current:
+            try:
+                async for frame in body:
+                    frames += 1
+                    size += len(frame)
+                    yield frame
+            finally:
+                current.set_attribute("frames", frames)
+                current.set_attribute("bytes", size)
+    finally:
+        root.end()
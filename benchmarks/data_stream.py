@@ -0,0 +1,68 @@
+"""
+Per-frame cost of the data stream encoder against the str.format based
+framing it replaced.
+
+    python -m benchmarks.data_stream
+"""
+import json
+import timeit
+
+from api.utils import data_stream
+
+
+TEXT = " weather"
+ARGS = '{"latitude": 48.8566, "longitude": 2.3522}'
+RESULT = {
+    "current": {"time": "2024-10-07T19:30", "temperature_2m": 29.3},
+    "hourly": {"temperature_2m": [20.5] * 168, "time": ["2024-10-07T00:00"] * 168},
+}
+
+
+def legacy_text():
+    return '0:{text}\n'.format(text=json.dumps(TEXT)).encode()
+
+
+def legacy_tool_result():
+    return 'a:{{"toolCallId":"{id}","toolName":"{name}","args":{args},"result":{result}}}\n'.format(
+        id="call_1", name="get_current_weather", args=ARGS, result=json.dumps(RESULT)).encode()
+
+
+def legacy_finish_step():
+    return 'e:{{"finishReason":"{reason}","usage":{{"promptTokens":{prompt},"completionTokens":{completion}}},"isContinued":false}}\n'.format(
+        reason="stop", prompt=1200, completion=345).encode()
+
+
+def encoder_text():
+    return data_stream.text_frame(TEXT)
+
+
+def encoder_tool_result():
+    return data_stream.tool_result_frame(
+        "call_1", "get_current_weather", data_stream.loads(ARGS), RESULT)
+
+
+def encoder_finish_step():
+    return data_stream.finish_step_frame("stop", 1200, 345)
+
+
+def measure(function, number):
+    best = min(timeit.repeat(function, number=number, repeat=5))
+    return best / number * 1e9
+
+
+def main():
+    cases = [
+        ("text", legacy_text, encoder_text, 200_000),
+        ("tool result", legacy_tool_result, encoder_tool_result, 5_000),
+        ("finish step", legacy_finish_step, encoder_finish_step, 200_000),
+    ]
+
+    print(f"{'frame':<12} {'legacy ns':>10} {'encoder ns':>11} {'speedup':>8}")
+    for name, legacy, encoder, number in cases:
+        before = measure(legacy, number)
+        after = measure(encoder, number)
+        print(f"{name:<12} {before:>10.0f} {after:>11.0f} {before / after:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Cold-start cost of the serverless function, measured per module.
+
+Each run imports api.index in a fresh interpreter under `python -X importtime`
+and parses the per-module timings it prints. Reports the median over all
+runs of the total import time, of the self time summed per top-level package,
+and of the slowest individual modules.
+
+    python -m benchmarks.importtime --output importtime.json
+    python -m benchmarks.importtime --baseline importtime.json --tolerance 0.2
+    python -m benchmarks.importtime --statement "import api.index; api.index.get_client()"
+
+With --baseline, exits non-zero if the total or any package is slower than
+the baseline by more than the tolerance and by more than --min-ms, so that
+noise in packages that only take a few milliseconds isn't reported.
+"""
+import os
+import re
+import sys
+import json
+import time
+import platform
+import argparse
+import statistics
+import subprocess
+from collections import defaultdict
+from typing import Dict, List, Set
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def measure(statement: str) -> Dict[str, Dict[str, int]]:
+    """Return {module: {"self_us", "cumulative_us", "depth"}} for one cold run."""
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "importtime")
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=ROOT, env=env, capture_output=True, text=True)
+
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr)
+
+    modules = {}
+    for line in process.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            modules[match.group(4)] = {
+                "self_us": int(match.group(1)),
+                "cumulative_us": int(match.group(2)),
+                "depth": len(match.group(3)) // 2,
+            }
+
+    return modules
+
+
+def summarize(runs: List[Dict[str, Dict[str, int]]], startup: Set[str], top: int) -> dict:
+    totals = []
+    packages = defaultdict(list)
+    modules = defaultdict(list)
+
+    for run in runs:
+        # Modules the bare interpreter imports (site, encodings, ...) aren't
+        # part of the cold start we can do anything about.
+        run = {name: module for name, module in run.items() if name not in startup}
+
+        totals.append(sum(
+            module["cumulative_us"] for module in run.values() if module["depth"] == 0))
+
+        per_package = defaultdict(int)
+        for name, module in run.items():
+            per_package[name.split(".")[0]] += module["self_us"]
+            modules[name].append(module["cumulative_us"])
+
+        for package, self_us in per_package.items():
+            packages[package].append(self_us)
+
+    packages = {
+        package: statistics.median(values) / 1000
+        for package, values in packages.items()
+    }
+    modules = {
+        name: statistics.median(values) / 1000
+        for name, values in modules.items()
+    }
+
+    return {
+        "total_ms": statistics.median(totals) / 1000,
+        "packages_ms": dict(sorted(packages.items(), key=lambda item: -item[1])),
+        "slowest_modules_ms": dict(sorted(modules.items(), key=lambda item: -item[1])[:top]),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_ms: float) -> List[str]:
+    regressions = []
+
+    pairs = [("total", results["total_ms"], baseline.get("total_ms"))]
+    pairs += [
+        (package, ms, baseline.get("packages_ms", {}).get(package, 0.0))
+        for package, ms in results["packages_ms"].items()
+        if ms >= min_ms
+    ]
+
+    for name, after, before in pairs:
+        if before is None:
+            continue
+
+        if after > before * (1 + tolerance) and after - before > min_ms:
+            regressions.append(f"{name}: {before:.1f}ms -> {after:.1f}ms")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--statement", default="import api.index")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=20, help="slowest modules to report")
+    parser.add_argument("--output", default="importtime_results.json")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--min-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    # This also warms the OS file cache before the measured runs.
+    startup = set(measure("pass"))
+    summary = summarize(
+        [measure(args.statement) for _ in range(args.runs)], startup, args.top)
+
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "statement": args.statement,
+            "runs": args.runs,
+        },
+        **summary,
+    }
+
+    print(f"total {results['total_ms']:.1f}ms")
+    print("packages (self time)")
+    for package, ms in results["packages_ms"].items():
+        if ms >= args.min_ms:
+            print(f"  {package:<32} {ms:>9.1f}ms")
+    print("slowest modules (cumulative)")
+    for name, ms in results["slowest_modules_ms"].items():
+        print(f"  {name:<48} {ms:>9.1f}ms")
+
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance, args.min_ms)
+
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
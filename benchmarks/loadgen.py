@@ -0,0 +1,183 @@
+"""
+Load generator for /api/chat.
+
+With no --url, a local uvicorn server is started with the fake OpenAI
+backend (OPENAI_FAKE) replaying --recording, so nothing leaves the machine
+and no tokens are spent. The weather recording calls open-meteo for its
+tool step.
+
+    python -m benchmarks.loadgen --concurrency 50 --requests 500
+    python -m benchmarks.loadgen --url http://localhost:8000 --json out.json
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import subprocess
+from typing import List, Tuple
+
+import httpx
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+
+    ordered = sorted(values)
+    index = min(int(fraction * len(ordered)), len(ordered) - 1)
+    return ordered[index]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(recording: str, ttft_ms: float, delay_ms: float) -> Tuple[subprocess.Popen, str]:
+    port = _free_port()
+    env = {
+        **os.environ,
+        "OPENAI_FAKE": recording,
+        "OPENAI_FAKE_TTFT_MS": str(ttft_ms),
+        "OPENAI_FAKE_DELAY_MS": str(delay_ms),
+        # Every request comes from this one client.
+        "ADMISSION_CLIENT_RATE": os.environ.get("ADMISSION_CLIENT_RATE", "0"),
+        "QUOTA_USER_TPM": os.environ.get("QUOTA_USER_TPM", "0"),
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api.index:app",
+         "--port", str(port), "--log-level", "warning"],
+        env=env,
+    )
+    url = f"http://127.0.0.1:{port}"
+
+    for _ in range(100):
+        try:
+            httpx.get(f"{url}/docs", timeout=0.5)
+            return server, url
+        except httpx.HTTPError:
+            time.sleep(0.1)
+
+    server.terminate()
+    raise RuntimeError("The local server did not start")
+
+
+async def one_request(client: httpx.AsyncClient, url: str, body: dict, results: dict):
+    start = time.perf_counter()
+    first = None
+    last = None
+    frames = 0
+    size = 0
+
+    try:
+        async with client.stream("POST", f"{url}/api/chat", json=body) as response:
+            if response.status_code != 200:
+                results["errors"] += 1
+                results["statuses"][response.status_code] = results["statuses"].get(
+                    response.status_code, 0) + 1
+                await response.aread()
+                return
+
+            async for line in response.aiter_lines():
+                now = time.perf_counter()
+                if first is None:
+                    first = now
+                    results["ttfb"].append(now - start)
+                else:
+                    results["gaps"].append(now - last)
+
+                last = now
+                frames += 1
+                size += len(line) + 1
+
+    except httpx.HTTPError:
+        results["errors"] += 1
+        return
+
+    results["latency"].append(time.perf_counter() - start)
+    results["frames"] += frames
+    results["bytes"] += size
+
+
+async def run(url: str, requests: int, concurrency: int, prompt: str) -> dict:
+    results = {"ttfb": [], "gaps": [], "latency": [], "frames": 0,
+               "bytes": 0, "errors": 0, "statuses": {}}
+    body = {"messages": [{"role": "user", "content": prompt}]}
+    queue = iter(range(requests))
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        async def worker():
+            for _ in queue:
+                await one_request(client, url, body, results)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+
+    completed = len(results["latency"])
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "completed": completed,
+        "errors": results["errors"],
+        "statuses": results["statuses"],
+        "elapsed_s": elapsed,
+        "requests_per_s": completed / elapsed,
+        "frames_per_s": results["frames"] / elapsed,
+        "bytes_per_s": results["bytes"] / elapsed,
+        "ttfb_ms": {
+            "p50": percentile(results["ttfb"], 0.50) * 1000,
+            "p95": percentile(results["ttfb"], 0.95) * 1000,
+            "p99": percentile(results["ttfb"], 0.99) * 1000,
+        },
+        "inter_frame_ms": {
+            "p50": percentile(results["gaps"], 0.50) * 1000,
+            "p99": percentile(results["gaps"], 0.99) * 1000,
+            "max": max(results["gaps"], default=0) * 1000,
+        },
+        "latency_ms": {
+            "p50": percentile(results["latency"], 0.50) * 1000,
+            "p99": percentile(results["latency"], 0.99) * 1000,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", help="target server; default starts a local one")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--prompt", default="Tell me about streaming.")
+    parser.add_argument("--recording", default="benchmarks/recordings/chat.jsonl")
+    parser.add_argument("--ttft-ms", type=float, default=300)
+    parser.add_argument("--delay-ms", type=float, default=20)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+
+    if url is None:
+        server, url = start_server(args.recording, args.ttft_ms, args.delay_ms)
+
+    try:
+        report = asyncio.run(run(url, args.requests, args.concurrency, args.prompt))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print(json.dumps(report, indent=2))
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
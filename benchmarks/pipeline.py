@@ -0,0 +1,305 @@
+"""
+Stage-by-stage benchmark of the /api/chat pipeline.
+
+Stages: Pydantic validation of the request body, convert_to_openai_messages
+(without the conversion cache, and with it cold and warm), per-chunk framing
+in stream_text, tool dispatch, and the full request through FastAPI against
+the fake OpenAI backend. Each runs over histories of 1 to 500 messages and over an
+attachment-heavy payload.
+
+    python -m benchmarks.pipeline --output results.json
+    python -m benchmarks.pipeline --baseline results.json --tolerance 0.2
+
+With --baseline, exits non-zero if any stage's median is slower than the
+baseline by more than the tolerance.
+"""
+import os
+
+os.environ.setdefault("OPENAI_FAKE", os.path.join(
+    os.path.dirname(__file__), "recordings", "chat.jsonl"))
+os.environ.setdefault("OPENAI_FAKE_TTFT_MS", "0")
+os.environ.setdefault("OPENAI_FAKE_DELAY_MS", "0")
+os.environ.setdefault("ADMISSION_CLIENT_RATE", "0")
+os.environ.setdefault("QUOTA_USER_TPM", "0")
+
+import sys
+import json
+import time
+import asyncio
+import platform
+import argparse
+from typing import Awaitable, Callable, Dict, List
+
+import httpx
+
+from api import index
+from api.utils import coalesce, prompt
+from api.utils.executor import execute_tool_calls
+from api.utils.registry import ToolRegistry
+
+from .protocol import Client, make_chunks
+
+
+HISTORY_LENGTHS = (1, 10, 50, 100, 500)
+MIN_TIME = 0.3
+
+
+def make_history(length: int, attachments: int = 0) -> List[dict]:
+    hourly = {
+        "time": [f"2024-10-07T{hour:02d}:00" for hour in range(24)] * 2,
+        "temperature_2m": [18.5] * 48,
+    }
+    image = "data:image/png;base64," + "A" * 64_000
+    messages = []
+
+    for index_ in range(length):
+        if index_ % 2 == 0:
+            message = {"role": "user", "content": f"Question {index_}: what is the weather like in Paris today?"}
+            if attachments:
+                message["experimental_attachments"] = [
+                    {"name": f"photo-{n}.png", "contentType": "image/png", "url": image}
+                    for n in range(attachments)
+                ] + [{"name": "notes.txt", "contentType": "text/plain", "url": "Notes " * 500}]
+        elif index_ % 4 == 1:
+            message = {
+                "role": "assistant",
+                "content": "",
+                "toolInvocations": [{
+                    "state": "result",
+                    "toolCallId": f"call_{index_}",
+                    "toolName": "get_current_weather",
+                    "args": {"latitude": 48.8566, "longitude": 2.3522},
+                    "result": {
+                        "latitude": 48.86, "longitude": 2.35, "timezone": "Europe/Paris",
+                        "current_units": {"temperature_2m": "°C"},
+                        "current": {"time": "2024-10-07T19:30", "temperature_2m": 18.5},
+                        "hourly_units": {"temperature_2m": "°C"},
+                        "hourly": hourly,
+                        "daily": {"sunrise": ["2024-10-07T07:42"], "sunset": ["2024-10-07T19:12"]},
+                    },
+                }],
+            }
+        else:
+            message = {"role": "assistant", "content": "It is mild and cloudy, around 18°C, with a chance of rain tonight. " * 3}
+
+        messages.append(message)
+
+    return messages
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    return {
+        "runs": len(ordered),
+        "mean_us": sum(ordered) / len(ordered) * 1e6,
+        "p50_us": ordered[len(ordered) // 2] * 1e6,
+        "p99_us": ordered[min(int(len(ordered) * 0.99), len(ordered) - 1)] * 1e6,
+    }
+
+
+def measure(function: Callable[[], object], min_time: float = MIN_TIME) -> Dict[str, float]:
+    samples = []
+    deadline = time.perf_counter() + min_time
+
+    while time.perf_counter() < deadline or len(samples) < 5:
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+
+    return summarize(samples)
+
+
+async def measure_async(function: Callable[[], Awaitable[object]], min_time: float = MIN_TIME) -> Dict[str, float]:
+    samples = []
+    deadline = time.perf_counter() + min_time
+
+    while time.perf_counter() < deadline or len(samples) < 5:
+        start = time.perf_counter()
+        await function()
+        samples.append(time.perf_counter() - start)
+
+    return summarize(samples)
+
+
+def bench_validation(payloads: Dict[str, str]) -> Dict[str, dict]:
+    return {
+        name: measure(lambda: index.Request.model_validate_json(body))
+        for name, body in payloads.items()
+    }
+
+
+def bench_conversion(payloads: Dict[str, str]) -> Dict[str, dict]:
+    results = {}
+
+    for name, body in payloads.items():
+        messages = index.Request.model_validate_json(body).messages
+        default_size = prompt.CONVERSION_CACHE_SIZE
+
+        try:
+            prompt.CONVERSION_CACHE_SIZE = 0
+            results[f"{name}/uncached"] = measure(
+                lambda: prompt.convert_to_openai_messages(messages, index.available_tools))
+
+            prompt.CONVERSION_CACHE_SIZE = 4096
+
+            def cold():
+                prompt._conversion_cache.clear()
+                prompt.convert_to_openai_messages(messages, index.available_tools)
+
+            results[f"{name}/cold"] = measure(cold)
+
+            prompt.convert_to_openai_messages(messages, index.available_tools)
+            results[f"{name}/warm"] = measure(
+                lambda: prompt.convert_to_openai_messages(messages, index.available_tools))
+
+        finally:
+            prompt.CONVERSION_CACHE_SIZE = default_size
+            prompt._conversion_cache.clear()
+
+    return results
+
+
+async def bench_framing() -> Dict[str, dict]:
+    tokens = ["The", " weather", " in", " Paris", " is", " mild", ",", ' "18°C"', ".\n"] * 100
+    client = index.client
+    index.client = Client(make_chunks(tokens))
+    default_coalesce_ms = coalesce.STREAM_COALESCE_MS
+    results = {}
+
+    async def drain():
+        async for _ in index.stream_text([], "data"):
+            pass
+
+    try:
+        for coalesce_ms in (0, 15):
+            coalesce.STREAM_COALESCE_MS = coalesce_ms
+            result = await measure_async(drain)
+            result["per_chunk_us"] = result["p50_us"] / len(tokens)
+            results[f"coalesce_{coalesce_ms}ms"] = result
+    finally:
+        index.client = client
+        coalesce.STREAM_COALESCE_MS = default_coalesce_ms
+
+    return results
+
+
+async def bench_tool_dispatch() -> Dict[str, dict]:
+    registry = ToolRegistry()
+
+    @registry.tool(description="Echo asynchronously")
+    async def echo_async(value: int):
+        return {"value": value}
+
+    @registry.tool(description="Echo in a thread")
+    def echo_sync(value: int):
+        return {"value": value}
+
+    results = {}
+
+    for name in ("echo_async", "echo_sync"):
+        for count in (1, 5):
+            calls = [
+                {"id": f"call_{n}", "name": name, "arguments": json.dumps({"value": n})}
+                for n in range(count)
+            ]
+
+            async def dispatch():
+                async for _ in execute_tool_calls(calls, registry):
+                    pass
+
+            results[f"{name}/{count}_calls"] = await measure_async(dispatch)
+
+    return results
+
+
+async def bench_full_path(payloads: Dict[str, str]) -> Dict[str, dict]:
+    transport = httpx.ASGITransport(app=index.app)
+    results = {}
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for name, body in payloads.items():
+            async def post():
+                response = await client.post(
+                    "/api/chat", content=body,
+                    headers={"content-type": "application/json"})
+                response.raise_for_status()
+
+            results[name] = await measure_async(post)
+
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    regressions = []
+
+    for stage, cases in results["stages"].items():
+        for case, result in cases.items():
+            before = baseline.get("stages", {}).get(stage, {}).get(case)
+            if before is None:
+                continue
+
+            ratio = result["p50_us"] / before["p50_us"]
+            if ratio > 1 + tolerance:
+                regressions.append(
+                    f"{stage}/{case}: {before['p50_us']:.1f}us -> {result['p50_us']:.1f}us ({ratio:.2f}x)")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    payloads = {
+        f"history_{length}": json.dumps({"messages": make_history(length)})
+        for length in HISTORY_LENGTHS
+    }
+    payloads["attachments_10x4"] = json.dumps(
+        {"messages": make_history(10, attachments=3)})
+
+    async def run_async():
+        return {
+            "framing": await bench_framing(),
+            "tool_dispatch": await bench_tool_dispatch(),
+            "full_path": await bench_full_path(payloads),
+        }
+
+    stages = {
+        "validation": bench_validation(payloads),
+        "conversion": bench_conversion(payloads),
+        **asyncio.run(run_async()),
+    }
+
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        },
+        "stages": stages,
+    }
+
+    for stage, cases in stages.items():
+        print(stage)
+        for case, result in cases.items():
+            print(f"  {case:<28} p50 {result['p50_us']:>11.1f}us  p99 {result['p99_us']:>11.1f}us")
+
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
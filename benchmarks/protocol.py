@@ -0,0 +1,97 @@
+"""
+Bytes on the wire and CPU per token of the `data` and `text` protocols,
+measured through stream_text with an in-memory upstream stream.
+
+    python -m benchmarks.protocol
+"""
+import os
+import time
+import asyncio
+
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+from openai.types.chat import ChatCompletionChunk
+
+from api import index
+from api.utils import coalesce
+
+
+SAMPLE = (
+    'The forecast for Paris shows "mild" temperatures around 18°C, with '
+    "light winds from the west.\nExpect clouds in the afternoon and a chance "
+    "of rain after 6pm. Sunrise is at 07:42 and sunset at 19:12. "
+)
+TOKENS = 2000
+
+
+def make_chunks(tokens):
+    base = {"id": "chatcmpl", "created": 0, "model": "gpt-4o",
+            "object": "chat.completion.chunk"}
+    chunks = [
+        ChatCompletionChunk.model_validate(
+            {**base, "choices": [{"index": 0, "delta": {"content": token}}]})
+        for token in tokens
+    ]
+    chunks.append(ChatCompletionChunk.model_validate(
+        {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}))
+    chunks.append(ChatCompletionChunk.model_validate(
+        {**base, "choices": [], "usage": {"prompt_tokens": 100, "completion_tokens": len(tokens), "total_tokens": 100 + len(tokens)}}))
+    return chunks
+
+
+class Stream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+class Completions:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def create(self, **kwargs):
+        return Stream(self.chunks)
+
+
+class Client:
+    def __init__(self, chunks):
+        self.chat = type("Chat", (), {"completions": Completions(chunks)})()
+
+
+async def run(protocol, coalesce_ms):
+    size = 0
+    frames = 0
+    start = time.process_time()
+
+    coalesce.STREAM_COALESCE_MS = coalesce_ms
+    async for frame in index.stream_text([], protocol):
+        size += len(frame)
+        frames += 1
+
+    return size, frames, time.process_time() - start
+
+
+def main():
+    tokens = [SAMPLE[i:i + 4] for i in range(0, len(SAMPLE), 4)]
+    tokens = (tokens * (TOKENS // len(tokens) + 1))[:TOKENS]
+    index.client = Client(make_chunks(tokens))
+    default_coalesce_ms = coalesce.STREAM_COALESCE_MS
+
+    print(f"{TOKENS} tokens, {sum(len(t.encode()) for t in tokens)} content bytes")
+    print(f"{'protocol':<8} {'coalesce':>8} {'bytes':>8} {'bytes/token':>12} {'frames':>7} {'us/token':>9}")
+
+    try:
+        for coalesce_ms in (0, 15):
+            for protocol in ("data", "text"):
+                asyncio.run(run(protocol, coalesce_ms))
+                size, frames, cpu = asyncio.run(run(protocol, coalesce_ms))
+                print(f"{protocol:<8} {coalesce_ms:>6}ms {size:>8} {size / TOKENS:>12.2f} {frames:>7} {cpu / TOKENS * 1e6:>9.2f}")
+    finally:
+        coalesce.STREAM_COALESCE_MS = default_coalesce_ms
+
+
+if __name__ == "__main__":
+    main()